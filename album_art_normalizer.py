@@ -0,0 +1,1443 @@
+import os, sys, argparse, time, subprocess, queue, threading, math, random, shutil, signal
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak RSS simply isn't reported
+    resource = None
+from artcache import ResultCache
+from metrics import Recorder, RunReport, merge
+from discovery import scan, paths, Manifest
+from watcher import make_watcher, Debouncer
+from dedup import dhash, cluster, identical, write_report
+from journal import Journal, sync, parse_shard, in_shard
+from embedded import AUDIO_EXT, extract, front_cover, write_picture
+from PIL import Image, features
+from io import BytesIO
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+SHRINK_URL = 'https://tinypng.com/web/shrink'
+HEADERS = {
+    'user-agent': 'Mozilla/5.0',
+    'content-type': 'image/png'
+}
+CACHE_DIR = '.cache'
+CACHE_KEYS = ('max_res', 'min_res', 'png_max', 'jpeg_quality', 'progressive', 'pad_tolerance', 'pad_tp_thres')
+IMAGE_EXT = ('.png', '.jpg', '.jpeg')
+PALETTE_SIZES = (16, 32, 64, 128, 256)
+JPEG_EXT = ('.jpg', '.jpeg')
+# Keeps each jpegoptim command line well under OS argument limits
+JPEGOPTIM_BATCH = 64
+
+class Normalizer:
+    def __init__(self):
+        self.verbose = True
+        self.name = None
+        self.output = None
+        self.jobs = 1
+        self.del_original = True
+        self.in_memory = False
+        self.sizes = None
+        self.img = None
+        self.analysis = None
+        self.recorder = Recorder()
+        self.failures = []
+        self.png_max = 5120
+        self.min_res = 1000
+        self.max_res = 2000
+        self.jpeg_quality = 85
+        self.progressive = True
+        self.pad_tolerance = 5
+        self.pad_tp_thres = 100
+
+    def log(self, text):
+        if self.verbose:
+            print(text)
+
+    def settings(self):
+        return {k: v for k, v in vars(self).items() if k not in ('img', 'name', 'analysis', 'recorder', 'failures')}
+
+    def batch_normalize(self, files, on_result=None, on_failure=None):
+        if self.jobs > 1:
+            return self.parallel_normalize(files, on_result, on_failure)
+
+        results = []
+
+        # Discovery may hand over a generator, whose length isn't known up front
+        total = f"/{len(files)}" if hasattr(files, '__len__') else ''
+
+        for index, file in enumerate(files):
+            self.log(f"({index+1}{total}) Normalizing {os.path.basename(file)} ...")
+            result = self.try_normalize(file)
+
+            if self.failed(result):
+                if on_failure: on_failure(result)
+                continue
+
+            results.append(result)
+            if on_result: on_result(result)
+
+        return results
+
+    def parallel_normalize(self, files, on_result=None, on_failure=None):
+        results = []
+        pending = {}
+        files = iter(files)
+        # Cap in-flight work so huge batches don't queue every path up front
+        max_pending = self.jobs * 2
+
+        # Files that were in flight when a worker died; they're rerun one at a time to find the one that killed it
+        suspects = []
+        pool = ProcessPoolExecutor(self.jobs, initializer=init_worker, initargs=(self.settings(),))
+
+        try:
+            while True:
+                if suspects:
+                    if not pending:
+                        file = suspects.pop(0)
+                        pending[pool.submit(normalize_worker, file)] = file
+                else:
+                    for file in files:
+                        pending[pool.submit(normalize_worker, file)] = file
+                        if len(pending) >= max_pending: break
+
+                if not pending: break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                # A worker that died outright (e.g. killed for memory) breaks the whole pool, failing every future in it
+                if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                    done, _ = wait(pending)
+                    crashed = {future for future in done if isinstance(future.exception(), BrokenProcessPool)}
+
+                    pool.shutdown()
+                    pool = ProcessPoolExecutor(self.jobs, initializer=init_worker, initargs=(self.settings(),))
+
+                    # Only a file that was running on its own is known to be the culprit and is failed below;
+                    # otherwise every file that went down with the pool gets another go
+                    if len(crashed) > 1:
+                        suspects += [pending.pop(future) for future in crashed]
+                        done -= crashed
+
+                for future in done:
+                    file = pending.pop(future)
+                    result = future.result() if not future.exception() else error_result(file, future.exception())
+
+                    if self.failed(result):
+                        if on_failure: on_failure(result)
+                        continue
+
+                    results.append(result)
+                    self.log(f"({len(results)}) Normalized {os.path.basename(result['file'])} -> {result['format']} "
+                             f"in {sum(result['timings'].values()):.2f}s")
+                    if on_result: on_result(result)
+        finally:
+            pool.shutdown()
+
+        peaks = [result['peak_rss'] for result in results if result['peak_rss']]
+        if peaks: self.log(f"Peak worker RSS: {max(peaks) >> 20}MB")
+
+        return results
+
+    def try_normalize(self, file, data=None):
+        # One unreadable or broken file shouldn't take the rest of a large batch down with it
+        try:
+            return self.normalize(file, data)
+        except Exception as e:
+            if self.img: self.img.close()
+            self.img = None
+            return error_result(file, e, self.recorder)
+
+    def failed(self, result):
+        if 'error' not in result:
+            return False
+
+        print(f"Failed to normalize {result['file']}: {result['error']}")
+        self.failures.append(result)
+        return True
+
+    def normalize(self, file, data=None):
+        self.recorder = rec = Recorder()
+        rec.count('source_bytes', os.path.getsize(file) if data is None else len(data))
+
+        with rec.stage('open'):
+            # Callers that already hold the encoded image pass it as data; file then only names the output
+            self.img = Image.open(file if data is None else BytesIO(data))
+            self.name = os.path.splitext(os.path.basename(file))[0]
+            width, height = self.img.size
+
+        self.log(f"  {width}x{height}")
+
+        with rec.stage('decode'):
+            if max(width, height) > self.max_res:
+                self.draft()
+            self.img.load()
+
+        if max(width, height) > self.max_res:
+            with rec.stage('resize'):
+                self.resize()
+
+        with rec.stage('analyse'):
+            self.analysis = analyse(self.img)
+
+        if width != height:
+            with rec.stage('pad'):
+                self.pad()
+
+        with rec.stage('save'):
+            outputs = self.save_pyramid() if self.sizes else [self.save()]
+
+        self.img.close()
+        self.img = None
+
+        levels = []
+
+        for ofile, data, fmt in outputs:
+            rec.count('normalized_bytes', len(data) if self.in_memory else os.path.getsize(ofile))
+            levels.append({'output': ofile, 'format': fmt, 'data': data} if self.in_memory else {'output': ofile, 'format': fmt})
+
+        result = rec.record(file=str(file), **levels[0], analysis=self.analysis, peak_rss=peak_rss())
+
+        if self.sizes:
+            result['levels'] = levels[1:]
+
+        # Deletion waits until the Compressor has written the final artifact, so a file it fails on can be retried
+        result['delete_original'] = self.del_original
+
+        return result
+
+    def draft(self):
+        # JPEG can decode at 1/2, 1/4 or 1/8 scale in the DCT domain; other formats ignore this and decode in full
+        if self.img.draft(None, (self.max_res, self.max_res)):
+            self.log(f"  Decoding at reduced size {self.img.size[0]}x{self.img.size[1]}...")
+
+    def resize(self):
+        self.log("  Resizing image...")
+        self.img.thumbnail((self.max_res, self.max_res), Image.Resampling.LANCZOS)
+
+    def pad(self):
+        width, height = self.img.size
+        diff = abs(width-height)
+
+        if diff <= self.pad_tolerance:
+            self.log(f"  Difference of {diff} is under tolerance of {self.pad_tolerance}. Skipping...")
+        elif diff > self.pad_tp_thres:
+            with self.recorder.stage('adaptive'):
+                self.adaptive_resize()
+            self.pad_with_colour('tp')
+        else:
+            self.pad_with_colour('w')
+
+    def pad_with_colour(self, colour):
+        width, height = self.img.size
+        dim = max(width, height)
+
+        if colour == 'w':
+            # Continue a solid border into the padding instead of adding white bars
+            fill = self.analysis['border'] or (255, 255, 255)
+            self.log(f"  Padding image with {'white' if fill == (255, 255, 255) else 'border colour'}...")
+            img_pad = Image.new('RGB', (dim, dim), fill)
+            if self.img.mode != 'RGB': self.img = self.img.convert('RGB')
+            self.analysis['alpha'] = False
+        elif colour == 'tp':
+            self.log("  Padding image with transparency...")
+            img_pad = Image.new('RGBA', (dim, dim), (0, 0, 0, 0))
+            if self.img.mode != 'RGBA': self.img = self.img.convert('RGBA')
+            self.analysis['alpha'] = True
+
+        if width > height:
+            img_pad.paste(self.img, (0, (width-height) // 2))
+        else:
+            img_pad.paste(self.img, ((height-width) // 2, 0))
+
+        self.img = img_pad
+    
+    def adaptive_resize(self):
+        target = max(self.img.size)
+        step = 50
+        # Candidate targets mirror the old 50px walk: target, target-50, ... down to the last one >= min_res
+        last = max(0, (target - self.min_res) // step)
+        best = None
+
+        if last == 0:
+            return
+
+        size = self.probe_size(self.img)
+
+        if size <= self.png_max:
+            return
+
+        self.log("  Adaptively resizing image...")
+
+        # PNG size scales roughly with pixel count, so the first probe seeds the bisection
+        guess = target * (self.png_max / size) ** 0.5
+        mid = min(last, max(1, -(-int(target - guess) // step)))
+        lo, hi, found = 1, last, last
+
+        # Every candidate is smaller than this one, so probes resample a downscaled copy instead of the original
+        working = self.img.resize(self.fit_size(target - step), Image.Resampling.LANCZOS)
+
+        while lo <= hi:
+            temp_img = working if mid == 1 else working.resize(self.fit_size(target - mid*step, working), Image.Resampling.LANCZOS)
+
+            if self.probe_size(temp_img) <= self.png_max:
+                found, hi, best = mid, mid - 1, temp_img
+            else:
+                lo = mid + 1
+
+            mid = (lo + hi) // 2
+
+        self.log(f"  Settled on {target - found*step}px after {self.recorder.counters['probes']} probe encodes")
+
+        if best is None:
+            best = working if found == 1 else working.resize(self.fit_size(target - found*step, working), Image.Resampling.LANCZOS)
+
+        self.img = best
+
+    def probe_size(self, img):
+        temp_store = BytesIO()
+        img.save(temp_store, 'png', optimize=True)
+        self.recorder.count('probes')
+        return temp_store.tell() // (1<<10)
+
+    def fit_size(self, target, img=None):
+        width, height = (self.img if img is None else img).size
+        scale = target / max(width, height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def save(self, img=None, name=None):
+        img = self.img if img is None else img
+        name = self.name if name is None else name
+
+        if self.has_transparency():
+            return (*self.save_png(img, name), 'png')
+        else:
+            return (*self.save_jpeg(img, name), 'jpeg')
+
+    def save_pyramid(self):
+        native = max(self.img.size)
+        targets = [size for size in self.sizes if size < native]
+
+        # Never upscale: requested sizes above the image collapse into one native-size level
+        if len(targets) < len(self.sizes):
+            targets.insert(0, native)
+
+        img = self.img
+        futures = []
+
+        # Each level is downscaled from the previous one, and encoded while the next is being resized
+        with ThreadPoolExecutor(len(targets)) as pool:
+            for size in targets:
+                if size < max(img.size):
+                    img = img.resize(self.fit_size(size, img), Image.Resampling.LANCZOS)
+
+                futures.append(pool.submit(self.save, img, f"{self.name}_{size}"))
+
+        return [future.result() for future in futures]
+
+    def has_transparency(self):
+        # Tracked through padding so the final image never needs another scan
+        return self.analysis['alpha']
+
+    def save_png(self, img, name):
+        self.log("  Saving as PNG...")
+
+        ofile = f"{self.output}/{name}.png"
+
+        return ofile, self.encode(img, ofile, 'png', optimize=True)
+
+    def save_jpeg(self, img, name):
+        self.log("  Saving as JPEG...")
+
+        if (img.mode != 'RGB'):
+            img = img.convert('RGB')
+
+        ofile = f"{self.output}/{name}.jpg"
+
+        # Pillow writes no EXIF/ICC unless asked, so this is already the final stripped, Huffman-optimized file
+        try:
+            data = self.encode(img, ofile, 'jpeg', optimize=True, progressive=self.progressive, quality='keep')
+        except ValueError:
+            data = self.encode(img, ofile, 'jpeg', optimize=True, progressive=self.progressive, quality=self.jpeg_quality)
+
+        return ofile, data
+
+    def encode(self, img, ofile, fmt, **params):
+        temp_store = BytesIO()
+        img.save(temp_store, fmt, **params)
+
+        # In-memory mode hands the bytes to the Compressor, which does the only write
+        if self.in_memory:
+            return temp_store.getvalue()
+
+        write_atomic(ofile, temp_store.getbuffer())
+
+def peak_rss():
+    # On Linux ru_maxrss survives fork and exec, so a freshly spawned worker would report its parent's peak.
+    # VmHWM belongs to the current address space and starts over with it.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) << 10
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak << 10
+
+def analyse(img):
+    # Imported here so importing the module stays cheap for library callers
+    import numpy as np
+
+    # One pass over the working image for what pad and save act on: any see-through pixels, and a solid border colour
+    # A transparency key (tRNS in P, L and RGB PNGs) only shows up as alpha once converted
+    if 'transparency' in img.info or img.mode in ('LA', 'PA'):
+        img = img.convert('RGBA')
+    elif img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGB')
+
+    pixels = np.asarray(img)
+    alpha = img.mode == 'RGBA' and bool((pixels[..., 3] < 255).any())
+
+    edges = np.concatenate((pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]))
+    border = None
+
+    if (edges == edges[0]).all() and (img.mode == 'RGB' or edges[0][3] == 255):
+        border = tuple(int(c) for c in edges[0][:3])
+
+    return {
+        'alpha': alpha,
+        'border': border
+    }
+
+# Each pool process keeps its own Normalizer so per-file state never crosses workers
+_worker_nml = None
+
+def init_worker(settings):
+    global _worker_nml
+    # Ctrl+C is handled by the parent, which lets in-flight files finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_nml = Normalizer()
+    vars(_worker_nml).update(settings)
+    _worker_nml.verbose = False
+
+def normalize_worker(file):
+    return _worker_nml.try_normalize(file)
+
+def combine(records):
+    # One record for all of a result's outputs; any level that failed fails the whole file
+    record = None
+
+    for level in records:
+        record = merge(record, level) if record else level
+        if 'error' in level: record['error'] = level['error']
+
+    return record
+
+def error_result(file, error, recorder=None):
+    return (recorder or Recorder()).record(file=str(file), error=f"{type(error).__name__}: {error}")
+
+class Compressor:
+    def __init__(self):
+        self.verbose = True
+        self.output = None
+        self.threshold = 0
+        self.backend = 'tinypng'
+        self.jpeg_backend = 'none'
+        self.jpeg_quality = 85
+        self.quality = 32
+        self.dither = True
+        self.jobs = 1
+        self.shrink_url = SHRINK_URL
+        self.connections = 4
+        self.retries = 5
+        self.backoff = 1
+        self.local = threading.local()
+
+    def log(self, text):
+        if (self.verbose):
+            print(text)
+
+    def settings(self):
+        return {k: v for k, v in vars(self).items() if k != 'local'}
+
+    def session(self):
+        # One keep-alive session per thread; requests sessions aren't safe to share across threads
+        if not hasattr(self.local, 'session'):
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            adapter = HTTPAdapter(pool_maxsize=self.connections)
+            self.local.session = requests.Session()
+            self.local.session.mount('http://', adapter)
+            self.local.session.mount('https://', adapter)
+
+        return self.local.session
+
+    def batch_compress(self, files):
+        records = []
+
+        if self.jpeg_backend == 'jpegoptim':
+            records += self.batch_jpegoptim([file for file in files if is_jpeg(file)])
+            files = [file for file in files if not is_jpeg(file)]
+
+        if self.backend == 'tinypng' and self.connections > 1:
+            return records + self.threaded_compress(files)
+
+        if self.jobs > 1:
+            return records + self.parallel_compress(files)
+
+        for index, file in enumerate(files):
+            self.log(f"({index+1}/{len(files)}) Compressing {os.path.basename(file)} ...")
+            records.append(self.compress(file))
+
+        return records
+
+    def threaded_compress(self, files):
+        records = []
+
+        with ThreadPoolExecutor(self.connections) as pool:
+            for index, record in enumerate(pool.map(self.compress, files)):
+                self.log(f"({index+1}/{len(files)}) Compressed {os.path.basename(record['output'])}")
+                records.append(record)
+
+        return records
+
+    def parallel_compress(self, files):
+        records = []
+
+        with ProcessPoolExecutor(self.jobs, initializer=init_compress_worker, initargs=(self.settings(),)) as pool:
+            for index, record in enumerate(pool.map(compress_worker, files, chunksize=4)):
+                self.log(f"({index+1}/{len(files)}) Compressed {os.path.basename(record['output'])}")
+                records.append(record)
+
+        return records
+
+    def batch_jpegoptim(self, files):
+        rec = Recorder()
+
+        with rec.stage('jpegoptim'):
+            self.jpegoptim(*files)
+
+        # One invocation covers the whole batch, so each file is charged an equal share
+        records = []
+
+        for file in files:
+            share = Recorder()
+            share.timings = {name: value / len(files) for name, value in rec.timings.items()}
+            share.cpu = {name: value / len(files) for name, value in rec.cpu.items()}
+            share.count('final_bytes', os.path.getsize(file))
+            records.append(share.record(output=file))
+
+        return records
+
+    def stream_compress(self, results, on_done=None):
+        # Drain until the None sentinel even after a failure so the producer never blocks on a full queue
+        error = None
+        count = 0
+        pending = set()
+        records = []
+        # jpegoptim runs once per JPEGOPTIM_BATCH files rather than once per file, so files with JPEG
+        # outputs wait here, already written, and are only finished once their batch has been optimized
+        batched = self.jpeg_backend == 'jpegoptim'
+        waiting = []
+        lock = threading.Lock()
+
+        def collect(done):
+            records.extend(f.result() for f in done if not f.exception())
+            return next((f.exception() for f in done if f.exception()), None)
+
+        def finish(result, record):
+            self.release(result, record)
+            if on_done: on_done(result, record)
+
+        def flush():
+            with lock:
+                batch, waiting[:] = waiting[:], []
+
+            if not batch: return
+
+            files = [output['output'] for result, _ in batch for output in [result] + result.get('levels', []) if is_jpeg(output['output'])]
+            shares = {record['output']: record for record in self.batch_jpegoptim(files)}
+
+            for result, record in batch:
+                outputs = [output['output'] for output in [result] + result.get('levels', [])]
+
+                for output in outputs:
+                    if output in shares: merge(record, shares[output])
+
+                # The sizes counted so far were from before jpegoptim rewrote the files
+                record['counters']['final_bytes'] = sum(os.path.getsize(output) for output in outputs)
+                finish(result, record)
+
+        def compress(result):
+            # One file that can't be compressed (a full disk, a corrupt output) fails on its own, like in the daemon.
+            # Letting it take the consumer down would leave the producer normalizing into a queue nobody compresses.
+            try:
+                record = self.compress_result(result, defer_jpegoptim=batched)
+            except Exception as e:
+                record = error_result(result['file'], e)
+                record['output'] = result['output']
+
+            if batched and 'error' not in record and any(is_jpeg(output['output']) for output in [result] + result.get('levels', [])):
+                with lock:
+                    waiting.append((result, record))
+                    full = len(waiting) >= JPEGOPTIM_BATCH
+
+                if full: flush()
+                return record
+
+            finish(result, record)
+            return record
+
+        with ThreadPoolExecutor(self.connections) as pool:
+            while (result := results.get()) is not None:
+                if error: continue
+
+                count += 1
+                self.log(f"({count}) Compressing {os.path.basename(result['output'])} ...")
+                pending.add(pool.submit(compress, result))
+
+                # Only pull more work once a slot frees up so the queue keeps applying backpressure
+                if len(pending) >= self.connections:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    error = collect(done)
+
+            done, _ = wait(pending)
+
+        error = error or collect(done)
+
+        if not error:
+            try:
+                flush()
+            except Exception as e:
+                error = e
+
+        return records, error
+
+    def compress(self, file, defer_jpegoptim=False):
+        with open(file, 'rb') as f:
+            data = f.read()
+
+        return self.compress_data(data, file, written=True, defer_jpegoptim=defer_jpegoptim)
+
+    def compress_result(self, result, defer_jpegoptim=False):
+        # In-memory results carry the encoded image instead of a file on disk
+        record = combine([self.compress_data(output.pop('data'), output['output'], defer_jpegoptim=defer_jpegoptim) if 'data' in output
+                          else self.compress(output['output'], defer_jpegoptim) for output in [result] + result.get('levels', [])])
+
+        # The caller releases the source, since a deferred jpegoptim pass may still have to rewrite the outputs
+        return record
+
+    def release(self, result, record):
+        # The source only goes once the final artifact is safely in place
+        if result.get('delete_original') and 'error' not in record: os.remove(result['file'])
+
+    def compress_data(self, data, ofile, written=False, defer_jpegoptim=False):
+        # Thread-local so backends can record into it without threading it through every call
+        self.local.recorder = rec = Recorder()
+        jpeg = is_jpeg(ofile)
+
+        with rec.stage('compress'):
+            compressed = self.shrink(data, jpeg)
+
+            if compressed is not None or not written:
+                write_atomic(ofile, data if compressed is None else compressed)
+
+            # jpegoptim only works on files, so it runs on the written artifact
+            if jpeg and self.jpeg_backend == 'jpegoptim' and not defer_jpegoptim:
+                self.jpegoptim(ofile)
+
+        rec.count('final_bytes', os.path.getsize(ofile))
+        record = rec.record(output=ofile)
+
+        # The uncompressed artifact stays in place, but it mustn't pass for a finished one
+        if rec.counters.get('compress_failed'):
+            record['error'] = f"{self.backend} failed after {self.retries} retries"
+
+        return record
+
+    def compress_bytes(self, data, ofile):
+        # Nothing is written, so jpegoptim, which only works on files, is skipped here
+        self.local.recorder = rec = Recorder()
+
+        with rec.stage('compress'):
+            compressed = self.shrink(data, is_jpeg(ofile))
+
+        return data if compressed is None else compressed
+
+    def shrink(self, data, is_jpeg):
+        if is_jpeg:
+            return JPEG_BACKENDS[self.jpeg_backend](self, data) if JPEG_BACKENDS[self.jpeg_backend] else None
+
+        # Left with PNGs here
+        if len(data) // (1<<10) > self.threshold:
+            return PNG_BACKENDS[self.backend](self, data)
+
+        self.log(f"  File size under {self.threshold}KB threshold. Skipping file...")
+
+    def tinypng(self, data):
+        import requests
+        from randagent import generate_useragent
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # Exponential backoff with full jitter so parallel uploads don't retry in lockstep
+                delay = random.uniform(0, self.backoff * (1 << attempt))
+                self.log(f"  Tinypng did not respond, retrying in {delay:.1f}s...")
+                self.local.recorder.count('retries')
+
+                with self.local.recorder.stage('backoff'):
+                    time.sleep(delay)
+
+            self.log("  Posting request to Tinypng...")
+
+            try:
+                with self.local.recorder.stage('upload'):
+                    response = self.session().post(
+                        self.shrink_url,
+                        headers={**HEADERS, 'user-agent': generate_useragent()},
+                        data=data,
+                        timeout=60
+                    )
+                    dct = response.json()
+            except (requests.RequestException, ValueError):
+                continue
+
+            if 'error' in dct or 'output' not in dct:
+                continue
+
+            try:
+                with self.local.recorder.stage('download'):
+                    return self.tinypng_download(dct['output']['url'])
+            except requests.RequestException:
+                continue
+
+        self.log(f"  Tinypng failed after {self.retries} retries. Keeping uncompressed file...")
+        self.local.recorder.count('compress_failed')
+
+    def tinypng_download(self, url):
+        from randagent import generate_useragent
+
+        response = self.session().get(
+            url,
+            headers={'user-agent': generate_useragent()},
+            stream=True,
+            timeout=60
+        )
+        response.raise_for_status()
+
+        self.log("  Downloading file from Tinypng...")
+
+        # Read the whole body here so a dropped connection is retried instead of written out
+        return b''.join(response.iter_content(1<<16))
+
+    def quantize(self, data):
+        self.log("  Quantizing locally...")
+
+        with Image.open(BytesIO(data)) as img:
+            has_alpha = 'A' in img.mode or 'transparency' in img.info
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+
+        # Smallest palette that still meets the quality target, assuming quality grows with palette size
+        lo, hi, best = 0, len(PALETTE_SIZES) - 1, None
+
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            candidate = self.palettize(img, PALETTE_SIZES[mid])
+
+            if psnr(img, candidate) >= self.quality:
+                best, hi = candidate, mid - 1
+            else:
+                lo = mid + 1
+
+        if best is None:
+            self.log(f"  No palette meets {self.quality}dB quality target. Skipping file...")
+            return None
+
+        temp_store = BytesIO()
+        best.save(temp_store, 'png', optimize=True)
+
+        if temp_store.tell() >= len(data):
+            self.log("  Quantized file is not smaller. Skipping file...")
+            return None
+
+        self.log(f"  Saving {len(best.getpalette()) // 3} colour PNG...")
+
+        return temp_store.getvalue()
+
+    def palettize(self, img, colours):
+        if img.mode == 'RGBA':
+            alpha = img.getchannel('A')
+
+            # Soft edges need a palette with alpha. libimagequant dithers those itself; FASTOCTREE can't dither at all.
+            if sum(alpha.histogram()[1:255]):
+                method = Image.Quantize.LIBIMAGEQUANT if features.check_feature('libimagequant') else Image.Quantize.FASTOCTREE
+                return img.quantize(colours, method=method)
+
+            # Fully on/off alpha, e.g. transparent padding: quantize the visible colours and keep one index for transparency
+            if alpha.getbbox() is None:
+                return img.quantize(1, method=Image.Quantize.FASTOCTREE)
+
+            rgb = img.convert('RGB')
+            palette = rgb.crop(alpha.getbbox()).quantize(colours - 1, method=Image.Quantize.MEDIANCUT)
+            result = rgb.quantize(palette=palette, dither=Image.Dither.FLOYDSTEINBERG if self.dither else Image.Dither.NONE)
+            index = len(palette.getpalette()) // 3
+
+            result.putpalette(palette.getpalette() + [0, 0, 0])
+            result.paste(index, mask=alpha.point(lambda a: 255 - a))
+            result.info['transparency'] = index
+
+            return result
+
+        palette = img.quantize(colours, method=Image.Quantize.MEDIANCUT)
+
+        if not self.dither:
+            return palette
+
+        # Pillow only dithers when remapping onto an existing palette
+        return img.quantize(palette=palette, dither=Image.Dither.FLOYDSTEINBERG)
+
+    def optimize_jpeg(self, data):
+        self.log("  Optimizing JPEG...")
+
+        with Image.open(BytesIO(data)) as img:
+            temp_store = BytesIO()
+
+            # Reusing the source quantization tables avoids another generation of loss
+            try:
+                img.save(temp_store, 'jpeg', optimize=True, progressive=True, quality='keep')
+            except ValueError:
+                img.save(temp_store, 'jpeg', optimize=True, progressive=True, quality=self.jpeg_quality)
+
+        if temp_store.tell() >= len(data):
+            self.log("  Optimized file is not smaller. Skipping file...")
+            return None
+
+        return temp_store.getvalue()
+
+    def jpegoptim(self, *files):
+        binary = find_jpegoptim()
+
+        if not binary:
+            self.log("  jpegoptim not found on PATH. Skipping...")
+            return
+
+        for index in range(0, len(files), JPEGOPTIM_BATCH):
+            self.log(f"  Compressing {len(files[index:index+JPEGOPTIM_BATCH])} file(s) with jpegoptim...")
+            subprocess.run([binary, '--quiet', '--strip-all', *files[index:index+JPEGOPTIM_BATCH]])
+
+PNG_BACKENDS = {
+    'tinypng': Compressor.tinypng,
+    'quantize': Compressor.quantize
+}
+
+# Backends take encoded bytes and return smaller bytes, or None to keep the input.
+# 'none' leaves the Normalizer's JPEGs as they are, since save_jpeg already writes optimized files.
+# 'jpegoptim' has no in-memory step; it runs on the written files, batched everywhere but in the daemon.
+JPEG_BACKENDS = {
+    'none': None,
+    'pillow': Compressor.optimize_jpeg,
+    'jpegoptim': None
+}
+
+def write_atomic(path, data):
+    # Write beside the target and rename so readers never see a half-written file.
+    # The temp name is unique, since sources like Album/cover.jpg and Other/cover.jpg share an output name.
+    # Created with 0666 rather than through mkstemp (0600), so the umask gives outputs their usual permissions.
+    temp = f"{path}.{os.urandom(8).hex()}.tmp"
+    fd = os.open(temp, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0), 0o666)
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+def copy_atomic(source, path):
+    with open(source, 'rb') as f:
+        write_atomic(path, f.read())
+
+def is_jpeg(path):
+    return os.path.splitext(path)[1].lower() in JPEG_EXT
+
+def find_jpegoptim():
+    # Fall back to a binary placed next to the script, as the README describes
+    return shutil.which('jpegoptim') or shutil.which('jpegoptim', path=os.path.dirname(os.path.abspath(__file__)))
+
+def psnr(original, candidate):
+    import numpy as np
+
+    a = np.asarray(original, dtype=np.float32)
+    b = np.asarray(candidate.convert(original.mode), dtype=np.float32)
+
+    # Premultiply, so colour hidden under transparent pixels doesn't count against the palette
+    if original.mode == 'RGBA':
+        a = np.concatenate((a[..., :3] * a[..., 3:] / 255, a[..., 3:]), axis=-1)
+        b = np.concatenate((b[..., :3] * b[..., 3:] / 255, b[..., 3:]), axis=-1)
+
+    mse = float(((a - b) ** 2).mean())
+
+    if mse == 0:
+        return float('inf')
+
+    return 10 * math.log10(255 ** 2 / mse)
+
+_worker_cmpr = None
+
+def init_compress_worker(settings):
+    global _worker_cmpr
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_cmpr = Compressor()
+    vars(_worker_cmpr).update(settings)
+    _worker_cmpr.verbose = False
+
+def compress_worker(file):
+    return _worker_cmpr.compress(file)
+
+def pipeline(**settings):
+    # Keyword settings are Normalizer/Compressor attributes, e.g. max_res=1000 or backend='quantize'
+    nml, cmpr = Normalizer(), Compressor()
+    nml.verbose = cmpr.verbose = False
+
+    for key, value in settings.items():
+        if not hasattr(nml, key) and not hasattr(cmpr, key):
+            raise TypeError(f"Unknown setting '{key}'")
+
+        for obj in (nml, cmpr):
+            if hasattr(obj, key): setattr(obj, key, value)
+
+    # Same ordering as the CLI: levels are downscaled largest first and the full-size output is the largest level
+    if nml.sizes:
+        nml.sizes = sorted({int(size) for size in nml.sizes}, reverse=True)
+        nml.max_res = nml.sizes[0]
+
+    # The library never touches the filesystem
+    nml.in_memory = True
+    nml.del_original = False
+
+    return nml, cmpr
+
+def process(data, name='cover', nml=None, cmpr=None, report=None, **settings):
+    """Normalize and compress one encoded image held in memory.
+
+    Returns a list of (filename, bytes), the full-size output first followed by any `sizes` levels.
+    Pass objects from pipeline() to reuse them, and their Tinypng sessions, across calls.
+    Pass a RunReport to have the image's timings added to it, and its hooks called, once it is done.
+    """
+    if nml is None:
+        nml, cmpr = pipeline(**settings)
+
+    result = nml.normalize(name, data)
+    outputs = []
+
+    for output in [result] + result.get('levels', []):
+        outputs.append((os.path.basename(output['output']), cmpr.compress_bytes(output.pop('data'), output['output'])))
+        merge(result, cmpr.local.recorder.record())
+
+    if report: report.add(result)
+
+    return outputs
+
+def init_service_worker(nml_settings, cmpr_settings):
+    init_worker(nml_settings)
+    init_compress_worker(cmpr_settings)
+
+    # Load every Pillow plugin and numpy up front so the first request doesn't pay for them
+    import numpy  # noqa: F401 -- imported only to warm the module cache
+    Image.init()
+
+def service_worker(data, name):
+    return process(data, name, _worker_nml, _worker_cmpr)
+
+def initParser():
+    parser = argparse.ArgumentParser()
+    # Must be done to add required augments at the front
+    parser._action_groups.pop()
+
+    required = parser.add_argument_group('required arguments')
+    optional = parser.add_argument_group('optional arguments')
+
+    required.add_argument('-p', '--path', type=str, help="Path to PNG/JPG file or directory of PNGs/JPGs. Not needed with --serve.")
+    optional.add_argument('-o', '--output', type=str, default='_output', help="Output folder for compressed images. Defaults to '_output' folder in script directory.")
+    optional.add_argument('--sizes', type=str, help="Comma-separated list of output sizes, e.g. 2000,1000,600,300. Each image is decoded once and saved as <name>_<size> at every size.")
+    optional.add_argument('-k', '--keep-originals', action='store_true', help="Keep source images instead of deleting them after normalizing.")
+    optional.add_argument('-m', '--manifest', action='store_true', help="Only process files that are new or changed since the last run with --manifest. Best combined with --keep-originals. Implies --stream, so each file is recorded as soon as it is done.")
+    optional.add_argument('--walkers', type=int, default=1, help="Number of threads listing directories, or reading audio metadata with --embedded, in parallel. Defaults to 1.")
+    optional.add_argument('-e', '--embedded', action='store_true', help="Process artwork embedded in FLAC/MP3/M4A files instead of image files. Identical covers within an album folder are processed once.")
+    optional.add_argument('--write-back', action='store_true', help="With --embedded, replace the embedded artwork with the optimized image where it fits in place (FLAC and ID3v2.3/2.4).")
+    optional.add_argument('--journal', action='store_true', help=f"Record each file's progress in '{CACHE_DIR}' under the output folder so an interrupted run resumes where it stopped. Originals are only deleted once their output is on disk.")
+    optional.add_argument('--shard', type=parse_shard, metavar='I/N', help="Only process the I-th of N hash-based slices of the input, e.g. 2/4, so several hosts can split one job on shared storage. Each shard keeps its own journal.")
+    optional.add_argument('-d', '--daemon', action='store_true', help="Keep running and normalize images as they appear in the input folder.")
+    optional.add_argument('--watch', type=str, action='append', help="Additional folder to watch in daemon mode. May be given multiple times.")
+    optional.add_argument('--settle', type=float, default=2, help="Seconds a file must stay unchanged before it is processed in daemon mode. Defaults to 2.")
+    optional.add_argument('--interval', type=float, default=2, help="Seconds between rescans when inotify is unavailable. Defaults to 2.")
+    optional.add_argument('--serve', type=int, metavar='PORT', help="Run an HTTP service on this port instead: POST an image to /normalize and get the optimized image back.")
+    optional.add_argument('--host', type=str, default='127.0.0.1', help="Address the service listens on. Defaults to 127.0.0.1.")
+    optional.add_argument('-j', '--jobs', type=int, default=1, help="Number of processes used for normalization. Defaults to 1.")
+    optional.add_argument('-s', '--stream', action='store_true', help="Compress each image as soon as it is normalized instead of after the whole batch.")
+    optional.add_argument('--in-memory', action='store_true', help="Pass encoded images straight to the compressor and write each output once. Implies --stream.")
+    optional.add_argument('--queue-size', type=int, default=8, help="Maximum number of normalized images waiting for compression in stream mode, or requests waiting for a worker with --serve. Defaults to 8.")
+    optional.add_argument('-b', '--backend', type=str, default='tinypng', choices=PNG_BACKENDS, help="PNG compression backend. 'quantize' runs locally without network access. Defaults to 'tinypng'.")
+    optional.add_argument('--jpeg-backend', type=str, default='none', choices=JPEG_BACKENDS, help="Extra JPEG compression after normalizing. 'pillow' re-encodes in-process, 'jpegoptim' runs jpegoptim from PATH in batches. Defaults to 'none'.")
+    optional.add_argument('-q', '--quality', type=float, default=32, help="Minimum PSNR in dB a quantized PNG must reach. Colour under transparent pixels is ignored. Defaults to 32.")
+    optional.add_argument('--no-dither', action='store_true', help="Disable dithering when quantizing opaque PNGs.")
+    optional.add_argument('--connections', type=int, default=4, help="Number of concurrent Tinypng uploads. Defaults to 4.")
+    optional.add_argument('--retries', type=int, default=5, help="Number of times a failed Tinypng request is retried. Defaults to 5.")
+    optional.add_argument('--shrink-url', type=str, default=SHRINK_URL, help="Tinypng-compatible shrink endpoint, e.g. a local stand-in server.")
+    optional.add_argument('-r', '--report', type=str, help="Write per-file stage timings and counters to this .json or .csv file and print a summary.")
+    optional.add_argument('--dedup', action='store_true', help="Process visually identical images once and copy the result to every duplicate. Only byte-identical duplicates have their originals deleted.")
+    optional.add_argument('--dedup-threshold', type=int, default=4, help="Maximum differing bits out of 64 for two images to count as duplicates. Defaults to 4.")
+    optional.add_argument('--dedup-report', type=str, help=f"Where to write the dedup report. Defaults to 'dedup.json' in '{CACHE_DIR}' under the output folder.")
+    optional.add_argument('-c', '--cache', action='store_true', help=f"Reuse results of previous runs stored in '{CACHE_DIR}' under the output folder.")
+    optional.add_argument('--cache-size', type=int, default=1024, help="Maximum size of the result cache in MB. Defaults to 1024.")
+
+    return parser
+    
+def preprocess(path, walkers=1, exclude=(), ext=IMAGE_EXT):
+    if not os.path.exists(path):
+        print(f"{path} does not exist!")
+        return None
+    
+    if os.path.isdir(path):
+        return scan(path, ext, walkers, exclude)
+
+    if os.path.splitext(path)[1].lower() in ext:
+        return [path]
+    else:
+        print("Unsupported file format!")
+        return None
+
+def processArgs(args):
+    if args.output == '_output' and not os.path.exists(args.output):
+        os.mkdir(args.output)
+    elif not os.path.isdir(args.output):
+        print(f"{args.output} is not a valid output directory!")  
+        exit(0)
+
+    output_dir = [file for file in Path(args.output).rglob('*')
+                  if file.is_file() and CACHE_DIR not in file.relative_to(args.output).parts]
+
+    # Unattended runs can't answer the prompt, so existing output is left alone
+    if output_dir and not args.daemon and sys.stdin.isatty():
+        while True:
+            ipt = input("Output directory is not empty. Delete all files in output directory? (Y/N) ")
+
+            if ipt.lower() == 'y':
+                print("Deleting files...")
+                for file in output_dir:
+                    os.remove(file)
+                
+                break
+            elif ipt.lower() == 'n':
+                break
+            else:
+                print("Invalid input. Please try again.")
+
+    return args
+
+def stream(nml, cmpr, files, queue_size, resumed=(), on_result=None, on_done=None, on_failure=None):
+    results = queue.Queue(max(1, queue_size))
+    outcome = {}
+
+    def consume():
+        outcome['records'], outcome['error'] = cmpr.stream_compress(results, on_done)
+
+    def handoff(result):
+        if on_result: on_result(result)
+        results.put(result)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+
+    try:
+        # Results recovered from an earlier run only need compressing
+        for result in resumed:
+            results.put(result)
+
+        normalized = nml.batch_normalize(files, handoff, on_failure)
+    finally:
+        results.put(None)
+        consumer.join()
+
+    if outcome.get('error'):
+        raise outcome['error']
+
+    return normalized, outcome['records']
+
+def daemon(nml, cmpr, dirs, settle, interval, report=None):
+    watcher = make_watcher(dirs, IMAGE_EXT, [nml.output], interval)
+    debouncer = Debouncer(settle)
+    processed = {}
+
+    # Long-lived pools keep Pillow and requests loaded between files
+    normalizers = ProcessPoolExecutor(nml.jobs, initializer=init_worker, initargs=(nml.settings(),))
+    compressors = ThreadPoolExecutor(cmpr.connections)
+    for _ in range(nml.jobs): normalizers.submit(int)
+
+    def compress(result):
+        try:
+            record = cmpr.compress_result(result)
+            cmpr.release(result, record)
+        except Exception as e:
+            record = error_result(result['output'], e)
+
+        merge(result, record)
+
+        if 'error' in record:
+            result['error'] = record['error']
+            print(f"Failed to compress {result['output']}: {record['error']}")
+        else:
+            print(f"Finished {os.path.basename(result['file'])} -> {os.path.basename(result['output'])}")
+
+        if report: report.add(result)
+
+    def handoff(future, file):
+        result = future.result() if not future.exception() else error_result(file, future.exception())
+
+        if 'error' in result:
+            print(f"Failed to normalize {file}: {result['error']}")
+            if report: report.add(result)
+            return
+
+        compressors.submit(compress, result)
+
+    print(f"Watching {', '.join(dirs)} ({'inotify' if hasattr(watcher, 'watches') else 'polling'})... Press Ctrl+C to stop.")
+
+    try:
+        while True:
+            debouncer.add(watcher.poll(0.5))
+
+            for file in debouncer.ready():
+                # Originals that are kept stay in the folder, so don't redo them unless they change
+                if not nml.del_original:
+                    stat = os.stat(file)
+                    if processed.get(file) == (stat.st_size, stat.st_mtime_ns): continue
+                    processed[file] = (stat.st_size, stat.st_mtime_ns)
+
+                normalizers.submit(normalize_worker, file).add_done_callback(lambda future, file=file: handoff(future, file))
+    except KeyboardInterrupt:
+        print("Stopping...")
+    finally:
+        watcher.close()
+        normalizers.shutdown()
+        compressors.shutdown()
+
+def configure(args):
+    nml = Normalizer()
+    nml.output = args.output
+    nml.jobs = max(1, args.jobs)
+    nml.del_original = not args.keep_originals
+    nml.in_memory = args.in_memory
+
+    if args.sizes:
+        nml.sizes = sorted({int(size) for size in args.sizes.split(',')}, reverse=True)
+        nml.max_res = nml.sizes[0]
+
+    cmpr = Compressor()
+    cmpr.output = args.output
+    cmpr.backend = args.backend
+    cmpr.jpeg_backend = args.jpeg_backend
+    cmpr.jpeg_quality = nml.jpeg_quality
+    cmpr.quality = args.quality
+    cmpr.dither = not args.no_dither
+    cmpr.jobs = nml.jobs
+    cmpr.connections = max(1, args.connections)
+    cmpr.retries = max(0, args.retries)
+    cmpr.shrink_url = args.shrink_url
+
+    return nml, cmpr
+
+def run_service(args):
+    # Only loaded when serving, so batch runs never import http.server
+    from artservice import serve
+
+    nml, cmpr = configure(args)
+    nml.verbose = cmpr.verbose = False
+    nml.in_memory = True
+    nml.del_original = False
+
+    server, url = serve(nml, cmpr, args.host, args.serve, args.queue_size)
+    print(f"Serving {url} with {nml.jobs} worker(s)... Press Ctrl+C to stop.")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print("Stopping...")
+    finally:
+        server.shutdown()
+        server.pool.shutdown()
+
+def begin(args):
+    files = preprocess(args.path, args.walkers, [args.output], AUDIO_EXT if args.embedded else IMAGE_EXT)
+
+    if files is None:
+        exit(0)
+
+    nml, cmpr = configure(args)
+
+    if args.daemon:
+        if not os.path.isdir(args.path):
+            print(f"{args.path} is not a directory!")
+            exit(0)
+
+        cmpr.verbose = False
+        report = RunReport() if args.report else None
+        daemon(nml, cmpr, [args.path] + (args.watch or []), args.settle, args.interval, report)
+
+        if report:
+            report.write(args.report)
+            report.log()
+
+        return
+
+    manifest = None
+
+    if args.manifest:
+        os.makedirs(os.path.join(args.output, CACHE_DIR), exist_ok=True)
+        manifest = Manifest(os.path.join(args.output, CACHE_DIR, 'manifest.db'))
+        files = manifest.changed(files)
+    else:
+        files = paths(files)
+
+    if args.shard:
+        index, count = args.shard
+        root = args.path if os.path.isdir(args.path) else os.path.dirname(args.path)
+        files = (file for file in files if in_shard(file, root, index, count))
+
+    sources = {}
+
+    if args.embedded:
+        staging = os.path.join(args.output, CACHE_DIR, 'embedded')
+        sources = extract(files, args.path if os.path.isdir(args.path) else os.path.dirname(args.path), staging, args.walkers)
+        print(f"Embedded: {len(sources)} unique cover(s) in {sum(len(tracks) for tracks in sources.values())} audio file(s)")
+        files = list(sources)
+        # The staged covers are our own copies; the audio files are only touched by --write-back
+        nml.del_original = True
+
+    duplicates, deletable = {}, set()
+
+    if args.dedup:
+        files = list(files)
+
+        if nml.jobs > 1:
+            with ProcessPoolExecutor(nml.jobs) as pool:
+                clusters = cluster(pool.map(dhash, files, chunksize=16), args.dedup_threshold)
+        else:
+            clusters = cluster(map(dhash, files), args.dedup_threshold)
+
+        duplicates = {c[0]: c[1:] for c in clusters if len(c) > 1}
+        # Staged embedded covers are our own copies; real files only go when they are exact copies
+        deletable = {m for members in duplicates.values() for m in members} if args.embedded else identical(clusters)
+        os.makedirs(os.path.join(args.output, CACHE_DIR), exist_ok=True)
+        summary = write_report(args.dedup_report or os.path.join(args.output, CACHE_DIR, 'dedup.json'), clusters)
+        print(f"Dedup: {summary['unique']} unique of {summary['files']} files, "
+              f"skipping {summary['skipped']} duplicates ({summary['skipped_bytes'] >> 10}KB)")
+        files = [c[0] for c in clusters]
+
+    del_original = nml.del_original
+    written, unwritten = [], []
+
+    def finish(file, outputs):
+        # Runs as each file completes, so an interrupted run keeps everything finished so far.
+        # Failed files never get here, which leaves their duplicates and manifest rows for the next run.
+        members = duplicates.get(file, [])
+
+        if members:
+            fan_out({file: members}, {file: outputs}, args.output, deletable if del_original else set())
+
+        done = [file] + members
+
+        if args.write_back:
+            updated, skipped = write_back({f: sources.get(f, []) for f in done}, {file: outputs}, {file: members})
+            written.extend(updated)
+            unwritten.extend(skipped)
+            if manifest: manifest.refresh(updated)
+
+        if manifest:
+            # Embedded covers are remembered by the audio files they came from
+            manifest.commit([track for f in done for track in sources.get(f, [])] if sources else done)
+
+    cache, keys, hits = None, {}, {}
+
+    if args.cache and nml.sizes:
+        print("The result cache only stores single outputs and is disabled with --sizes.")
+    elif args.cache:
+        cache = ResultCache(os.path.join(args.output, CACHE_DIR), args.cache_size << 20)
+        settings = {key: getattr(nml, key) for key in CACHE_KEYS}
+        settings.update(threshold=cmpr.threshold, backend=cmpr.backend, jpeg_backend=cmpr.jpeg_backend,
+                        quality=cmpr.quality, dither=cmpr.dither)
+
+        def skip_cached(files):
+            for file in files:
+                key = cache.key(file, settings)
+                stem = os.path.join(args.output, os.path.splitext(os.path.basename(file))[0])
+
+                if ofile := cache.fetch(key, stem):
+                    hits[str(file)] = ofile
+                    if del_original: os.remove(file)
+                    finish(str(file), [ofile])
+                    continue
+
+                keys[str(file)] = key
+                yield file
+
+        files = skip_cached(files)
+
+    journal, resumed, normalized = None, [], None
+
+    if args.journal or args.shard:
+        os.makedirs(os.path.join(args.output, CACHE_DIR), exist_ok=True)
+        journal = Journal(os.path.join(args.output, CACHE_DIR, f"journal-{index}of{count}.db" if args.shard else 'journal.db'))
+        # Normalizing no longer deletes anything; sources go once their outputs are committed
+        nml.del_original = False
+
+        for file, outputs in journal.resume():
+            resumed.append(Recorder().record(file=file, output=outputs[0], levels=[{'output': output} for output in outputs[1:]]))
+
+        files = journal.plan(files, del_original)
+
+        def normalized(result):
+            # In-memory outputs aren't on disk yet, so those files restart from the source
+            if not nml.in_memory:
+                journal.normalized(result['file'], [output['output'] for output in [result] + result.get('levels', [])])
+
+    unfinished = []
+    report = RunReport() if args.report else None
+
+    def completed(result, record):
+        outputs = [output['output'] for output in [result] + result.get('levels', [])]
+
+        if record:
+            merge(result, record)
+            if 'error' in record: result['error'] = record['error']
+
+        # Hooks hear about each file as soon as it is done, from whichever thread finished it
+        if report: report.add(result)
+
+        # An output left uncompressed is neither cached nor committed, so the next run tries it again
+        if record and 'error' in record:
+            print(f"Failed to compress {result['output']}: {record['error']}")
+            unfinished.append(result['file'])
+            return
+
+        if journal:
+            sync(outputs)
+            journal.done(result['file'])
+            if del_original and os.path.exists(result['file']): os.remove(result['file'])
+
+        if result['file'] in keys:
+            cache.store(keys[result['file']], result['output'])
+
+        finish(result['file'], outputs)
+
+    # In-memory results hold encoded images, so they must go through the bounded queue.
+    # Journaled and manifest runs stream too, so every file is committed as soon as it is compressed.
+    if journal or manifest or args.stream or nml.in_memory:
+        results, records = stream(nml, cmpr, files, args.queue_size, resumed, normalized if journal else None, completed,
+                                  report and report.add)
+        results += resumed
+    else:
+        results = nml.batch_normalize(files, on_failure=report and report.add)
+        records = cmpr.batch_compress([output['output'] for result in results for output in [result] + result.get('levels', [])])
+        compressed = {record['output']: record for record in records}
+
+        for result in results:
+            record = combine([compressed[output['output']] for output in [result] + result.get('levels', [])])
+            cmpr.release(result, record)
+            completed(result, record)
+
+    if report:
+        report.write(args.report)
+        report.log()
+
+    if cache:
+        totals = cache.totals()
+        print(f"Cache: {cache.hits} hits, {cache.misses} misses ({totals['hits']} hits, {totals['misses']} misses over all runs)")
+        cache.close()
+
+    if args.write_back:
+        print(f"Write-back: {len(written)} audio file(s) updated, {len(unwritten)} left as they were")
+
+    if manifest:
+        print(f"Manifest: {manifest.committed} new or changed, {manifest.unchanged} unchanged")
+        manifest.close()
+
+    if nml.failures:
+        print(f"{len(nml.failures)} file(s) failed to normalize and were left as they were")
+
+    if unfinished:
+        print(f"{len(unfinished)} file(s) could not be compressed and will be tried again next run")
+
+    if journal:
+        counts = journal.counts()
+        print(f"Journal: {len(results) - len(resumed)} normalized, {len(resumed)} resumed, {journal.finished} already done, "
+              f"{counts.get('done', 0)} of {sum(counts.values())} done in total")
+        journal.close()
+
+def fan_out(duplicates, outputs, output, deletable):
+    for file, members in duplicates.items():
+        # A representative that failed leaves its duplicates untouched; neither is committed to the manifest
+        if file not in outputs: continue
+
+        stem = os.path.splitext(os.path.basename(file))[0]
+
+        for member in members:
+            for source in outputs[file]:
+                # Keep whatever follows the stem, e.g. a pyramid level suffix and the chosen extension
+                ofile = os.path.join(output, os.path.splitext(os.path.basename(member))[0] + os.path.basename(source)[len(stem):])
+
+                if ofile != source:
+                    copy_atomic(source, ofile)
+
+            if member in deletable: os.remove(member)
+
+def main(argv=None):
+    parser = initParser()
+    args = parser.parse_args(argv)
+
+    # The service takes its images over HTTP, so it needs neither an input path nor the output prompt
+    if args.serve is not None:
+        return run_service(args)
+
+    if not args.path:
+        parser.error("the following arguments are required: -p/--path")
+
+    if args.write_back and not args.embedded:
+        parser.error("--write-back only applies to --embedded")
+
+    begin(processArgs(args))
+
+def write_back(sources, outputs, duplicates):
+    written, skipped = [], []
+
+    for file, tracks in sources.items():
+        # Duplicates share their representative's output
+        rep = next((rep for rep, members in duplicates.items() if file in members), file)
+        if rep not in outputs: continue
+
+        with open(outputs[rep][0], 'rb') as f:
+            data = f.read()
+
+        for track in tracks:
+            picture = front_cover(track)
+
+            if picture and len(data) < len(picture['data']) and write_picture(track, picture, data):
+                written.append(track)
+            else:
+                skipped.append(track)
+
+    return written, skipped
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
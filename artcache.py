@@ -0,0 +1,106 @@
+import os, json, time, sqlite3, hashlib, threading
+
+# Bump when pipeline output changes so stale artifacts stop matching
+CACHE_VERSION = 1
+
+class ResultCache:
+    def __init__(self, directory, max_size=1<<30):
+        self.directory = directory
+        self.objects = os.path.join(directory, 'objects')
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.objects, exist_ok=True)
+
+        # Results are stored from the compression threads as each file finishes
+        self.db = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, ext TEXT, size INTEGER, last_used REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)')
+        self.db.commit()
+
+    def key(self, file, settings):
+        digest = hashlib.sha256()
+        digest.update(json.dumps([CACHE_VERSION, settings], sort_keys=True).encode())
+
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1<<20), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def object_path(self, key, ext):
+        return os.path.join(self.objects, key[:2], key + ext)
+
+    def fetch(self, key, stem):
+        with self.lock:
+            row = self.db.execute('SELECT ext FROM entries WHERE key = ?', (key,)).fetchone()
+
+        if row is None or not os.path.exists(self.object_path(key, row[0])):
+            self.misses += 1
+            return None
+
+        # Imported here: the pipeline module imports this one
+        from album_art_normalizer import copy_atomic
+
+        # Copy for the same reason store() does. The rename also replaces an output hard-linked by an older
+        # version without touching the cached object, and an interrupted hit never leaves a truncated output.
+        ofile = stem + row[0]
+        copy_atomic(self.object_path(key, row[0]), ofile)
+
+        with self.lock:
+            self.db.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+            self.db.commit()
+
+        self.hits += 1
+
+        return ofile
+
+    def store(self, key, artifact):
+        ext = os.path.splitext(artifact)[1]
+        path = self.object_path(key, ext)
+
+        from album_art_normalizer import copy_atomic
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Copy rather than link so later in-place edits of the output can't corrupt the cache.
+        # Unique temp names keep concurrent stores of the same key from clobbering each other.
+        copy_atomic(artifact, path)
+
+        # Committed straight away so an interrupted run keeps everything it finished
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', (key, ext, os.path.getsize(path), time.time()))
+            self.evict()
+            self.db.commit()
+
+    def evict(self):
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+        if total <= self.max_size:
+            return
+
+        for key, ext, size in self.db.execute('SELECT key, ext, size FROM entries ORDER BY last_used').fetchall():
+            if total <= self.max_size: break
+
+            try:
+                os.remove(self.object_path(key, ext))
+            except FileNotFoundError:
+                pass
+
+            self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+
+    def totals(self):
+        # Across every run so far, this one included
+        with self.lock:
+            stored = dict(self.db.execute('SELECT name, value FROM stats').fetchall())
+
+        return {'hits': stored.get('hits', 0) + self.hits, 'misses': stored.get('misses', 0) + self.misses}
+
+    def close(self):
+        for name, value in (('hits', self.hits), ('misses', self.misses)):
+            self.db.execute('INSERT INTO stats VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?', (name, value, value))
+
+        self.db.commit()
+        self.db.close()
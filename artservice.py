@@ -0,0 +1,87 @@
+import os, threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from PIL import UnidentifiedImageError
+from album_art_normalizer import init_service_worker, service_worker
+
+# Local normalization service. POST an encoded image to /normalize and the optimized image comes back.
+# ?name= sets the output name and ?size= picks a level when the service runs with --sizes.
+
+MAX_UPLOAD = 64 << 20
+CONTENT_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg'}
+
+class NormalizeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body, content_type, headers=()):
+        self.send_response(status)
+        self.send_header('content-type', content_type)
+        self.send_header('content-length', str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('content-length', 0))
+
+        # The body is left unread on these replies, so the connection can't be reused
+        if url.path != '/normalize':
+            self.close_connection = True
+            return self.reply(404, b"Unknown endpoint\n", 'text/plain')
+
+        if not 0 < length <= MAX_UPLOAD:
+            self.close_connection = True
+            return self.reply(413, f"Upload must be between 1 byte and {MAX_UPLOAD >> 20}MB\n".encode(), 'text/plain')
+
+        # Shed load once every worker is busy and the queue is full, rather than queueing without bound
+        if not self.server.slots.acquire(blocking=False):
+            # Drain the upload, already known to be within MAX_UPLOAD, so the client sees the 503
+            # instead of a reset, and the connection stays usable for its retry
+            while length > 0:
+                chunk = self.rfile.read(min(length, 1 << 16))
+                if not chunk: break
+                length -= len(chunk)
+
+            return self.reply(503, b"Busy, try again shortly\n", 'text/plain', [('retry-after', '1')])
+
+        try:
+            data = self.rfile.read(length)
+            query = parse_qs(url.query)
+            name = os.path.basename(query.get('name', ['cover'])[0]) or 'cover'
+            outputs = self.server.pool.submit(service_worker, data, name).result()
+        except UnidentifiedImageError:
+            return self.reply(400, b"Not a supported image\n", 'text/plain')
+        except Exception as e:
+            return self.reply(500, f"{type(e).__name__}: {e}\n".encode(), 'text/plain')
+        finally:
+            self.server.slots.release()
+
+        if 'size' in query:
+            outputs = [output for output in outputs if os.path.splitext(output[0])[0].endswith(f"_{query['size'][0]}")]
+
+            if not outputs:
+                return self.reply(404, b"No output at that size\n", 'text/plain')
+
+        filename, body = outputs[0]
+        self.reply(200, body, CONTENT_TYPES[os.path.splitext(filename)[1]],
+                   [('content-disposition', f'inline; filename="{filename}"')])
+
+def serve(nml, cmpr, host='127.0.0.1', port=0, queue_size=8):
+    # Workers are started and warmed before the first request so none of them pays for imports
+    pool = ProcessPoolExecutor(nml.jobs, initializer=init_service_worker, initargs=(nml.settings(), cmpr.settings()))
+    wait([pool.submit(int) for _ in range(nml.jobs)])
+
+    server = ThreadingHTTPServer((host, port), NormalizeHandler)
+    server.daemon_threads = True
+    server.pool = pool
+    server.slots = threading.BoundedSemaphore(nml.jobs + max(0, queue_size))
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f"http://{server.server_address[0]}:{server.server_address[1]}/normalize"
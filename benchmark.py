@@ -0,0 +1,200 @@
+import os, argparse, json, time, shutil, tempfile, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image, ImageDraw
+import tinystub
+import album_art_normalizer as aan
+from metrics import merge, percentile
+
+# name: (width, height, mode, extension), chosen to hit each branch normalize() can take
+CASES = {
+    'square': (1500, 1500, 'RGB', '.jpg'),
+    'near_square': (1500, 1497, 'RGB', '.jpg'),
+    'white_pad': (1500, 1440, 'RGB', '.jpg'),
+    'wide': (2400, 1200, 'RGB', '.jpg'),
+    'rgba': (1200, 1200, 'RGBA', '.png'),
+    'palette_tp': (800, 760, 'P', '.png'),
+    'huge': (6000, 6000, 'RGB', '.jpg'),
+    'tiny': (200, 200, 'RGB', '.jpg')
+}
+STAGES = ('decode', 'resize', 'analyse', 'pad', 'adaptive', 'save', 'compress', 'upload', 'download', 'total')
+
+def make_art(width, height, mode, seed):
+    rng = np.random.RandomState(seed)
+
+    # Smooth gradient plus shapes and a little grain, so encoders see realistic content
+    y, x = np.mgrid[0:height, 0:width]
+    base = rng.randint(0, 256, 3)
+    pixels = np.stack([(base[c] + x * rng.uniform(-0.2, 0.2) + y * rng.uniform(-0.2, 0.2)) % 256 for c in range(3)], axis=-1)
+    pixels += rng.normal(0, 6, pixels.shape)
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB')
+
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, y0 = rng.randint(0, width), rng.randint(0, height)
+        size = rng.randint(max(2, min(width, height) // 20), max(3, min(width, height) // 3))
+        draw.ellipse((x0, y0, x0 + size, y0 + size), fill=tuple(int(c) for c in rng.randint(0, 256, 3)))
+
+    if mode == 'RGBA':
+        mask = Image.new('L', (width, height), 0)
+        ImageDraw.Draw(mask).ellipse((0, 0, width - 1, height - 1), fill=255)
+        img.putalpha(mask)
+    elif mode == 'P':
+        img = img.quantize(64)
+        ImageDraw.Draw(img).rectangle((0, 0, width // 4, height // 4), fill=63)
+        img.info['transparency'] = 63
+
+    return img
+
+def generate_corpus(directory, count, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    files = []
+
+    for index, (name, (width, height, mode, ext)) in enumerate(CASES.items()):
+        for copy in range(count):
+            path = os.path.join(directory, f"{name}_{copy}{ext}")
+
+            if not os.path.exists(path):
+                img = make_art(width, height, mode, seed * 1000 + index * 100 + copy)
+                params = {'quality': 92} if ext == '.jpg' else {'transparency': img.info['transparency']} if mode == 'P' else {}
+                img.save(path, **params)
+
+            files.append(path)
+
+    return files
+
+def run(files, args):
+    work = tempfile.mkdtemp(prefix='aan-bench-')
+    output = os.path.join(work, 'output')
+    os.makedirs(output)
+
+    # The pipeline deletes its input by default, so benchmark against throwaway copies
+    inputs = []
+    for file in files:
+        inputs.append(shutil.copy(file, work))
+
+    server, url = tinystub.serve(latency=args.latency)
+
+    nml = aan.Normalizer()
+    nml.output = output
+    nml.verbose = False
+    nml.jobs = args.jobs
+
+    cmpr = aan.Compressor()
+    cmpr.output = output
+    cmpr.verbose = False
+    cmpr.backend = args.backend
+    cmpr.jpeg_backend = args.jpeg_backend
+    cmpr.shrink_url = url
+    cmpr.backoff = 0
+
+    start = time.perf_counter()
+    results = nml.batch_normalize(inputs)
+
+    for result in results:
+        merge(result, cmpr.compress(result['output']))
+        result['timings']['total'] = sum(result['timings'].values())
+
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    stages = {}
+    for stage in STAGES:
+        values = [result['timings'][stage] for result in results if stage in result['timings']]
+        stages[stage] = {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99)
+        }
+
+    cases = {}
+    for result in results:
+        case = os.path.basename(result['file']).rsplit('_', 1)[0]
+        cases.setdefault(case, []).append(result['timings']['total'])
+
+    summary = {
+        'files': len(results),
+        'seconds': elapsed,
+        'throughput': len(results) / elapsed,
+        'peak_rss': max((result['peak_rss'] or 0 for result in results), default=0),
+        'bytes_in': sum(os.path.getsize(file) for file in files),
+        'bytes_out': sum(os.path.getsize(result['output']) for result in results),
+        'probes': sum(result['counters'].get('probes', 0) for result in results),
+        'stages': stages,
+        'cases': {case: percentile(values, 50) for case, values in cases.items()}
+    }
+
+    shutil.rmtree(work)
+
+    return summary
+
+def report(summary):
+    print(f"{summary['files']} files in {summary['seconds']:.2f}s ({summary['throughput']:.2f} files/s)")
+    print(f"Peak RSS {summary['peak_rss'] >> 20}MB, {summary['bytes_in'] >> 10}KB in, {summary['bytes_out'] >> 10}KB out, "
+          f"{summary['probes']} adaptive probe encodes")
+    print(f"{'stage':<10}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+
+    for stage, stats in summary['stages'].items():
+        if stats['count']:
+            print(f"{stage:<10}{stats['count']:>7}{stats['p50']*1000:>10.1f}{stats['p95']*1000:>10.1f}{stats['p99']*1000:>10.1f}")
+
+def compare(summary, baseline, tolerance, min_time):
+    regressions = []
+    metrics = [('throughput', summary['throughput'], baseline['throughput'], True),
+               ('peak_rss', summary['peak_rss'], baseline['peak_rss'], False),
+               ('bytes_out', summary['bytes_out'], baseline['bytes_out'], False)]
+    # Stages that only take a few milliseconds are mostly timer noise
+    metrics += [(f"{stage} p50", stats['p50'], baseline['stages'][stage]['p50'], False)
+                for stage, stats in summary['stages'].items()
+                if stats['count'] and stage in baseline['stages'] and baseline['stages'][stage]['p50'] >= min_time]
+
+    print(f"\n{'metric':<16}{'baseline':>14}{'current':>14}{'change':>10}")
+
+    for name, current, old, higher_is_better in metrics:
+        if not old: continue
+
+        change = (current - old) / old * 100
+        print(f"{name:<16}{old:>14.4g}{current:>14.4g}{change:>+9.1f}%")
+
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(name)
+
+    return regressions
+
+def initParser():
+    parser = argparse.ArgumentParser(description="Benchmark the normalize/compress pipeline on a synthetic album art corpus.")
+    parser.add_argument('--corpus', type=str, default='_bench_corpus', help="Folder for the generated corpus. Reused between runs. Defaults to '_bench_corpus'.")
+    parser.add_argument('--count', type=int, default=3, help="Images generated per case. Defaults to 3.")
+    parser.add_argument('--seed', type=int, default=0, help="Corpus seed. Defaults to 0.")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Normalization processes. Defaults to 1.")
+    parser.add_argument('-b', '--backend', type=str, default='tinypng', choices=aan.PNG_BACKENDS, help="PNG backend. Tinypng is served by a local stub. Defaults to 'tinypng'.")
+    parser.add_argument('--jpeg-backend', type=str, default='none', choices=aan.JPEG_BACKENDS, help="JPEG backend. Defaults to 'none'.")
+    parser.add_argument('--latency', type=float, default=0, help="Simulated Tinypng latency in seconds. Defaults to 0.")
+    parser.add_argument('--save', type=str, help="Write the results to this JSON file, e.g. to use as a baseline.")
+    parser.add_argument('--baseline', type=str, help="Compare against a JSON file written by --save.")
+    parser.add_argument('--tolerance', type=float, default=10, help="Percent change counted as a regression. Defaults to 10.")
+    parser.add_argument('--min-ms', type=float, default=20, help="Ignore stages whose baseline p50 is below this many milliseconds. Defaults to 20.")
+    return parser
+
+if __name__ == '__main__':
+    args = initParser().parse_args()
+    files = generate_corpus(os.path.join(args.corpus, f"seed{args.seed}"), args.count, args.seed)
+
+    # Run in a spawned interpreter so its address space, and so its VmHWM peak, never held the corpus generation
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        summary = pool.submit(run, files, args).result()
+
+    report(summary)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(summary, json.load(f), args.tolerance, args.min_ms / 1000)
+
+        if regressions:
+            print(f"\nRegressed beyond {args.tolerance}%: {', '.join(regressions)}")
+            exit(1)
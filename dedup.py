@@ -0,0 +1,129 @@
+import os, json, hashlib
+from PIL import Image
+
+def dhash(path):
+    # 64-bit difference hash from a 9x8 greyscale thumbnail; JPEGs decode at reduced scale via draft.
+    # dHash only sees brightness, so a 4x4 colour thumbnail goes along to tell recoloured covers apart.
+    try:
+        with Image.open(path) as img:
+            size = img.size
+            img.draft('RGB', (64, 64))
+            rgb = img.convert('RGB')
+            small = rgb.convert('L').resize((9, 8), Image.Resampling.BOX)
+            colour = rgb.resize((4, 4), Image.Resampling.BOX).tobytes()
+    except OSError:
+        # Leave unreadable files to the Normalizer, which logs them as failed and never commits them to the manifest
+        return path, None, None, None
+
+    pixels = small.tobytes()
+    bits = 0
+
+    for row in range(8):
+        for col in range(8):
+            bits = bits << 1 | (pixels[row*9 + col] < pixels[row*9 + col + 1])
+
+    return path, bits, size, colour
+
+def distance(a, b):
+    return bin(a ^ b).count('1')
+
+def colour_distance(a, b):
+    # Mean absolute difference per channel over the colour thumbnails, 0-255
+    return sum(abs(x - y) for x, y in zip(a, b)) / len(a)
+
+class BKTree:
+    def __init__(self):
+        self.root = None
+
+    def add(self, bits, item):
+        if self.root is None:
+            self.root = (bits, item, {})
+            return
+
+        node = self.root
+
+        while True:
+            d = distance(bits, node[0])
+
+            if d not in node[2]:
+                node[2][d] = (bits, item, {})
+                return
+
+            node = node[2][d]
+
+    def search(self, bits, radius):
+        found, stack = [], [self.root] if self.root else []
+
+        while stack:
+            node = stack.pop()
+            d = distance(bits, node[0])
+
+            if d <= radius:
+                found.append((d, node[1]))
+
+            # Triangle inequality: only children within radius of d can match
+            stack.extend(child for key, child in node[2].items() if d - radius <= key <= d + radius)
+
+        return [item for _, item in sorted(found, key=lambda match: match[0])]
+
+def cluster(hashes, threshold=4, aspect_tolerance=0.02, colour_tolerance=8):
+    tree = BKTree()
+    clusters = []
+
+    for path, bits, size, colour in hashes:
+        if bits is None:
+            clusters.append({'members': [(path, (0, 0))]})
+            continue
+
+        aspect = size[0] / size[1]
+
+        # dHash ignores aspect ratio and colour, so crops, letterboxed or recoloured variants must not count as the same cover
+        match = next((c for c in tree.search(bits, threshold)
+                      if abs(c['aspect'] - aspect) <= aspect * aspect_tolerance
+                      and colour_distance(c['colour'], colour) <= colour_tolerance), None)
+
+        if match is None:
+            match = {'aspect': aspect, 'colour': colour, 'members': []}
+            tree.add(bits, match)
+            clusters.append(match)
+
+        match['members'].append((path, size))
+
+    # Largest source is the one worth normalizing; everything else reuses its output
+    return [
+        [path for path, _ in sorted(c['members'], key=lambda member: member[1][0] * member[1][1], reverse=True)]
+        for c in clusters
+    ]
+
+def digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()
+
+def identical(clusters):
+    # Duplicates byte-for-byte equal to their representative. A perceptual match alone never justifies deleting a file.
+    same = set()
+
+    for c in clusters:
+        if len(c) < 2: continue
+
+        rep = digest(c[0])
+        same.update(member for member in c[1:] if digest(member) == rep)
+
+    return same
+
+def write_report(path, clusters):
+    duplicates = [c for c in clusters if len(c) > 1]
+    skipped = [member for c in duplicates for member in c[1:]]
+
+    report = {
+        'files': sum(len(c) for c in clusters),
+        'unique': len(clusters),
+        'skipped': len(skipped),
+        'skipped_bytes': sum(os.path.getsize(member) for member in skipped if os.path.exists(member)),
+        'clusters': [{'representative': c[0], 'duplicates': c[1:]} for c in duplicates]
+    }
+
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    return report
@@ -0,0 +1,96 @@
+import os, sqlite3, threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+def list_dir(path, ext, exclude):
+    files, dirs = [], []
+
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if os.path.abspath(entry.path) not in exclude: dirs.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in ext:
+                    files.append(entry)
+    except OSError as e:
+        print(f"Skipping {path}: {e.strerror}")
+
+    return files, dirs
+
+def scan(root, ext, workers=1, exclude=()):
+    # Yields matching DirEntry objects as soon as their directory is listed.
+    # Excluded folders (e.g. the output folder) are skipped so fresh outputs aren't picked up mid-run.
+    exclude = {os.path.abspath(path) for path in exclude}
+
+    if workers <= 1:
+        stack = [root]
+
+        while stack:
+            files, dirs = list_dir(stack.pop(), ext, exclude)
+            stack.extend(reversed(dirs))
+            yield from files
+
+        return
+
+    # scandir releases the GIL, so threads overlap directory round-trips on network storage
+    with ThreadPoolExecutor(workers) as pool:
+        pending = {pool.submit(list_dir, root, ext, exclude)}
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                files, dirs = future.result()
+                pending.update(pool.submit(list_dir, path, ext, exclude) for path in dirs)
+                yield from files
+
+def paths(entries):
+    for entry in entries:
+        yield getattr(entry, 'path', entry)
+
+class Manifest:
+    def __init__(self, path):
+        # Files are committed from the compression threads as they finish
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER)')
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.unchanged = 0
+        self.committed = 0
+
+    def changed(self, entries):
+        for entry in entries:
+            # DirEntry.stat() is served from the directory listing on Windows
+            stat = entry.stat() if isinstance(entry, os.DirEntry) else os.stat(entry)
+            path = getattr(entry, 'path', entry)
+
+            with self.lock:
+                row = self.db.execute('SELECT size, mtime FROM files WHERE path = ?', (path,)).fetchone()
+
+                if row == (stat.st_size, stat.st_mtime_ns):
+                    self.unchanged += 1
+                    continue
+
+                self.pending[path] = (stat.st_size, stat.st_mtime_ns)
+
+            yield path
+
+    def refresh(self, paths):
+        # Files the run rewrote itself shouldn't count as changed next time
+        for path in paths:
+            stat = os.stat(path)
+
+            with self.lock:
+                if path in self.pending: self.pending[path] = (stat.st_size, stat.st_mtime_ns)
+
+    def commit(self, paths):
+        # Called as each file finishes; only files that made it through the pipeline are remembered,
+        # so failures (and anything left when a run is interrupted) are retried next run
+        with self.lock:
+            rows = [(path, *self.pending.pop(path)) for path in paths if path in self.pending]
+            self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', rows)
+            self.db.commit()
+            self.committed += len(rows)
+
+    def close(self):
+        self.db.close()
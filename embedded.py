@@ -0,0 +1,288 @@
+import os, struct, hashlib
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+# Artwork embedded in audio files. Only metadata headers are read; the audio payload is always seeked past.
+
+AUDIO_EXT = ('.flac', '.mp3', '.m4a', '.mp4')
+FRONT_COVER = 3
+FLAC_PADDING, FLAC_PICTURE = 1, 6
+MP4_COVER_PATH = (b'moov', b'udta', b'meta', b'ilst', b'covr')
+MP4_TYPES = {13: 'image/jpeg', 14: 'image/png'}
+
+def read_pictures(path):
+    with open(path, 'rb') as f:
+        magic = f.read(12)
+        f.seek(0)
+
+        if magic[:4] == b'fLaC':
+            return flac_pictures(f)
+        if magic[:3] == b'ID3':
+            return id3_pictures(f)
+        if magic[4:8] == b'ftyp':
+            return mp4_pictures(f)
+
+    return []
+
+def front_cover(path):
+    pictures = read_pictures(path)
+    return next((p for p in pictures if p['type'] == FRONT_COVER), pictures[0] if pictures else None)
+
+def sniff(data, mime):
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if data[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+
+    return mime
+
+def flac_pictures(f):
+    f.seek(4)
+    pictures = []
+    last = False
+
+    while not last:
+        header = f.read(4)
+        if len(header) < 4: break
+
+        last, kind, length = header[0] >> 7, header[0] & 0x7f, int.from_bytes(header[1:], 'big')
+
+        if kind != FLAC_PICTURE:
+            f.seek(length, 1)
+            continue
+
+        offset = f.tell() - 4
+        block = f.read(length)
+        picture_type, mime_length = struct.unpack_from('>II', block)
+        mime = block[8:8 + mime_length].decode('ascii', 'replace')
+        pos = 8 + mime_length
+        description = block[pos + 4:pos + 4 + struct.unpack_from('>I', block, pos)[0]]
+        pos += 4 + len(description) + 16
+        data = block[pos + 4:pos + 4 + struct.unpack_from('>I', block, pos)[0]]
+
+        pictures.append({'container': 'flac', 'type': picture_type, 'mime': sniff(data, mime), 'data': data,
+                         'description': description, 'offset': offset, 'length': length, 'last': bool(last)})
+
+    return pictures
+
+def synchsafe(data):
+    return data[0] << 21 | data[1] << 14 | data[2] << 7 | data[3]
+
+def to_synchsafe(value):
+    return bytes((value >> shift) & 0x7f for shift in (21, 14, 7, 0))
+
+def id3_pictures(f):
+    header = f.read(10)
+    major, flags = header[3], header[5]
+    size = synchsafe(header[6:10])
+    tag = f.read(size)
+    # Tags that need rewriting beyond the picture frame itself are read but never written back
+    writable = major in (3, 4) and not flags & 0xc0
+
+    if flags & 0x80 and major < 4:
+        tag = tag.replace(b'\xff\x00', b'\xff')
+
+    pos = 0
+
+    if flags & 0x40:
+        pos = synchsafe(tag[:4]) if major == 4 else 4 + int.from_bytes(tag[:4], 'big')
+
+    header_size = 6 if major == 2 else 10
+    pictures = []
+
+    while pos + header_size <= len(tag) and tag[pos] != 0:
+        if major == 2:
+            frame, length, frame_flags = tag[pos:pos + 3], int.from_bytes(tag[pos + 3:pos + 6], 'big'), 0
+        else:
+            frame = tag[pos:pos + 4]
+            length = synchsafe(tag[pos + 4:pos + 8]) if major == 4 else int.from_bytes(tag[pos + 4:pos + 8], 'big')
+            frame_flags = tag[pos + 9]
+
+        body = tag[pos + header_size:pos + header_size + length]
+        start, pos = pos, pos + header_size + length
+
+        if frame not in (b'APIC', b'PIC'):
+            continue
+
+        # Compressed or encrypted frames (0x0c in v2.4, 0xc0 in v2.3) aren't worth supporting for artwork
+        if major == 4:
+            if frame_flags & 0x0c: continue
+            if frame_flags & 0x01: body = body[4:]
+            if frame_flags & 0x02: body = body.replace(b'\xff\x00', b'\xff')
+        elif major == 3:
+            if frame_flags & 0xc0: continue
+            if frame_flags & 0x20: body = body[1:]
+
+        encoding = body[0]
+
+        if frame == b'PIC':
+            mime, picture_type, rest = {b'PNG': 'image/png'}.get(body[1:4].upper(), 'image/jpeg'), body[4], body[5:]
+        else:
+            mime_end = body.index(b'\0', 1)
+            mime, picture_type, rest = body[1:mime_end].decode('latin-1'), body[mime_end + 1], body[mime_end + 2:]
+
+        # UTF-16 descriptions end with an aligned double null, the others with a single one
+        if encoding in (1, 2):
+            end = next(i for i in range(0, len(rest) - 1, 2) if rest[i:i + 2] == b'\0\0') + 2
+        else:
+            end = rest.index(b'\0') + 1
+
+        data = rest[end:]
+
+        pictures.append({'container': 'id3', 'type': picture_type, 'mime': sniff(data, mime), 'data': data,
+                         'encoding': encoding, 'description': rest[:end], 'writable': writable,
+                         'major': major, 'start': start, 'end': pos, 'size': size})
+
+    for picture in pictures:
+        picture['frames_end'] = pos
+
+    return pictures
+
+def atoms(f, start, end):
+    pos = start
+
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, name = struct.unpack('>I4s', f.read(8))
+        header = 8
+
+        if size == 1:
+            size, header = struct.unpack('>Q', f.read(8))[0], 16
+        elif size == 0:
+            size = end - pos
+
+        if size < header: break
+
+        yield name, pos + header, pos + size
+        pos += size
+
+def mp4_pictures(f):
+    start, end = 0, f.seek(0, 2)
+
+    # Walk straight down to the cover atom; mdat and the sample tables are never read
+    for name in MP4_COVER_PATH:
+        start, end = next(((body, stop) for atom, body, stop in atoms(f, start, end) if atom == name), (None, None))
+
+        if start is None:
+            return []
+
+        # iTunes' meta is a full atom with four bytes of version and flags before its children
+        if name == b'meta':
+            f.seek(start + 4)
+            if f.read(4) != b'hdlr': start += 4
+
+    pictures = []
+
+    for atom, body, stop in atoms(f, start, end):
+        if atom != b'data': continue
+
+        f.seek(body)
+        kind = struct.unpack('>I', f.read(8)[:4])[0] & 0xffffff
+        data = f.read(stop - body - 8)
+        pictures.append({'container': 'mp4', 'type': FRONT_COVER, 'mime': sniff(data, MP4_TYPES.get(kind, 'image/jpeg')), 'data': data})
+
+    return pictures
+
+def write_picture(path, picture, data):
+    # Rewrites the picture in place when it fits in the space it already occupies, so the audio never moves
+    if picture['container'] == 'flac':
+        return write_flac(path, picture, data)
+    if picture['container'] == 'id3' and picture['writable']:
+        return write_id3(path, picture, data)
+
+    return False
+
+def write_flac(path, picture, data):
+    with Image.open(BytesIO(data)) as img:
+        width, height = img.size
+        depth = 24 if img.mode == 'P' else 8 * len(img.getbands())
+        colours = len(img.getpalette()) // 3 if img.mode == 'P' else 0
+
+    mime = sniff(data, picture['mime']).encode()
+    block = (struct.pack('>II', picture['type'], len(mime)) + mime + struct.pack('>I', len(picture['description']))
+             + picture['description'] + struct.pack('>IIIII', width, height, depth, colours, len(data)) + data)
+
+    with open(path, 'r+b') as f:
+        space, last = picture['length'], picture['last']
+
+        # A padding block right after the picture can absorb the difference too
+        if not last:
+            f.seek(picture['offset'] + 4 + picture['length'])
+            header = f.read(4)
+
+            if len(header) == 4 and header[0] & 0x7f == FLAC_PADDING:
+                space += 4 + int.from_bytes(header[1:], 'big')
+                last = bool(header[0] >> 7)
+
+        if len(block) == space:
+            blocks = bytes([last << 7 | FLAC_PICTURE]) + len(block).to_bytes(3, 'big') + block
+        elif len(block) + 4 <= space:
+            padding = space - len(block) - 4
+            blocks = (bytes([FLAC_PICTURE]) + len(block).to_bytes(3, 'big') + block
+                      + bytes([last << 7 | FLAC_PADDING]) + padding.to_bytes(3, 'big') + bytes(padding))
+        else:
+            return False
+
+        f.seek(picture['offset'])
+        f.write(blocks)
+
+    return True
+
+def write_id3(path, picture, data):
+    mime = sniff(data, picture['mime']).encode('latin-1')
+    body = bytes([picture['encoding']]) + mime + b'\0' + bytes([picture['type']]) + picture['description'] + data
+    length = to_synchsafe(len(body)) if picture['major'] == 4 else len(body).to_bytes(4, 'big')
+    frame = b'APIC' + length + b'\0\0' + body
+
+    with open(path, 'r+b') as f:
+        f.seek(10)
+        tag = f.read(picture['size'])
+        frames = tag[:picture['start']] + frame + tag[picture['end']:picture['frames_end']]
+
+        # The tag keeps its size, so the new frames have to fit in the old frames plus padding
+        if len(frames) > picture['size']:
+            return False
+
+        f.seek(10)
+        f.write(frames + bytes(picture['size'] - len(frames)))
+
+    return True
+
+def read_cover(path):
+    try:
+        return path, front_cover(path)
+    except (OSError, ValueError, IndexError, StopIteration, struct.error) as e:
+        print(f"Skipping {path}: unreadable metadata ({e})")
+        return path, None
+
+def extract(files, root, staging, workers=1):
+    # One file per distinct cover in each album folder; sources maps it back to the audio files it came from
+    os.makedirs(staging, exist_ok=True)
+    albums, sources = {}, {}
+
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        for path, picture in pool.map(read_cover, files):
+            if picture is None: continue
+
+            album = os.path.dirname(os.path.abspath(path))
+            key = (album, hashlib.sha1(picture['data']).hexdigest())
+
+            if key not in albums:
+                rel = os.path.relpath(album, os.path.abspath(root))
+                name = os.path.splitext(os.path.basename(path))[0] if rel == '.' else rel.replace(os.sep, ' - ')
+
+                # A second, different cover in the same album is named after its track
+                if any(album == other for other, _ in albums):
+                    name = f"{name} - {os.path.splitext(os.path.basename(path))[0]}"
+
+                staged = os.path.join(staging, name + ('.png' if picture['mime'] == 'image/png' else '.jpg'))
+
+                with open(staged, 'wb') as f:
+                    f.write(picture['data'])
+
+                albums[key] = staged
+
+            sources.setdefault(albums[key], []).append(path)
+
+    return sources
@@ -0,0 +1,102 @@
+import os, sys, json, time, sqlite3, threading, zlib
+
+# States a file moves through. Sources are only deleted once a file is 'done'.
+PENDING, NORMALIZED, DONE = 'pending', 'normalized', 'done'
+
+class Journal:
+    # Durable per-file progress, so an interrupted run resumes where it stopped
+    def __init__(self, path):
+        # Written from the normalize loop and the compression threads
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS jobs (path TEXT PRIMARY KEY, state TEXT, outputs TEXT, updated REAL)')
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.finished = 0
+
+    def plan(self, files, del_original=False):
+        # Yields the files that still need normalizing; finished ones are skipped and normalized ones are left to resume()
+        for file in files:
+            with self.lock:
+                row = self.db.execute('SELECT state FROM jobs WHERE path = ?', (file,)).fetchone()
+
+                if row is None:
+                    self.db.execute('INSERT INTO jobs VALUES (?, ?, NULL, ?)', (file, PENDING, time.time()))
+
+            if row and row[0] == DONE:
+                self.finished += 1
+
+                # A run that stopped between committing and deleting leaves the source behind
+                if del_original and os.path.exists(file): os.remove(file)
+                continue
+
+            if row and row[0] == NORMALIZED:
+                continue
+
+            yield file
+
+    def resume(self):
+        # Normalized files whose outputs are all still on disk only need compressing
+        with self.lock:
+            rows = self.db.execute('SELECT path, outputs FROM jobs WHERE state = ?', (NORMALIZED,)).fetchall()
+
+        resumable = []
+
+        for file, outputs in rows:
+            outputs = json.loads(outputs)
+
+            if all(os.path.exists(output) for output in outputs):
+                resumable.append((file, outputs))
+            else:
+                self.set(file, PENDING)
+
+        return resumable
+
+    def normalized(self, file, outputs):
+        self.set(file, NORMALIZED, outputs)
+
+    def done(self, file):
+        self.set(file, DONE)
+
+    def set(self, file, state, outputs=None):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)',
+                            (file, state, json.dumps(outputs) if outputs else None, time.time()))
+            self.db.commit()
+
+    def counts(self):
+        with self.lock:
+            return dict(self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+
+    def close(self):
+        self.db.close()
+
+def sync(paths):
+    # Flush the artifacts and the renames that put them in place before anything is deleted
+    for path in paths:
+        with open(path, 'rb+') as f:
+            os.fsync(f.fileno())
+
+    # Directories can't be opened for fsync on Windows, where the rename is already durable
+    if sys.platform == 'win32':
+        return
+
+    for directory in {os.path.dirname(os.path.abspath(path)) for path in paths}:
+        fd = os.open(directory, os.O_RDONLY)
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def parse_shard(text):
+    index, count = (int(part) for part in text.split('/'))
+
+    if not 1 <= index <= count:
+        raise ValueError(f"Shard {text} is not between 1/{count} and {count}/{count}")
+
+    return index, count
+
+def in_shard(path, root, index, count):
+    # Hash the path relative to the input folder so hosts mounting the share at different places still agree
+    rel = os.path.relpath(path, root).replace(os.sep, '/')
+    return zlib.crc32(rel.encode()) % count == index - 1
@@ -0,0 +1,130 @@
+import csv, json, time
+from contextlib import contextmanager
+
+class Recorder:
+    # Per-file stage timings and counters. Stages may nest; each one keeps only its exclusive time.
+    def __init__(self):
+        self.timings = {}
+        self.cpu = {}
+        self.counters = {}
+        self.stack = []
+
+    @contextmanager
+    def stage(self, name):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        self.stack.append([0, 0])
+
+        try:
+            yield
+        finally:
+            child_wall, child_cpu = self.stack.pop()
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+
+            self.timings[name] = self.timings.get(name, 0) + wall - child_wall
+            self.cpu[name] = self.cpu.get(name, 0) + cpu - child_cpu
+
+            if self.stack:
+                self.stack[-1][0] += wall
+                self.stack[-1][1] += cpu
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self, **fields):
+        return {**fields, 'timings': self.timings, 'cpu': self.cpu, 'counters': self.counters}
+
+def merge(result, record):
+    # Fold a Compressor record into the Normalizer result for the same output file
+    for key in ('timings', 'cpu', 'counters'):
+        for name, value in record[key].items():
+            result[key][name] = result[key].get(name, 0) + value
+
+    return result
+
+def percentile(values, pct):
+    if not values:
+        return 0
+
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+class RunReport:
+    def __init__(self, hooks=None):
+        self.records = []
+        self.hooks = list(hooks or [])
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def add(self, record):
+        self.records.append(record)
+
+        for hook in self.hooks:
+            hook(record)
+
+    def summary(self):
+        stages = {}
+
+        for record in self.records:
+            for name, value in record['timings'].items():
+                stages.setdefault(name, {'wall': [], 'cpu': []})
+                stages[name]['wall'].append(value)
+                stages[name]['cpu'].append(record['cpu'].get(name, 0))
+
+        counters = {}
+
+        for record in self.records:
+            for name, value in record['counters'].items():
+                counters[name] = counters.get(name, 0) + value
+
+        return {
+            'files': len(self.records),
+            'failed': sum('error' in record for record in self.records),
+            'stages': {
+                name: {
+                    'count': len(values['wall']),
+                    'total': sum(values['wall']),
+                    'cpu': sum(values['cpu']),
+                    'p50': percentile(values['wall'], 50),
+                    'p95': percentile(values['wall'], 95),
+                    'p99': percentile(values['wall'], 99)
+                } for name, values in stages.items()
+            },
+            'counters': counters
+        }
+
+    def write(self, path):
+        if path.lower().endswith('.csv'):
+            return self.write_csv(path)
+
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(), 'files': self.records}, f, indent=2, default=str)
+
+    def write_csv(self, path):
+        stages = sorted({name for record in self.records for name in record['timings']})
+        counters = sorted({name for record in self.records for name in record['counters']})
+
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['file', 'output', 'format', 'error'] + [f"{name}_wall" for name in stages]
+                            + [f"{name}_cpu" for name in stages] + counters)
+
+            for record in self.records:
+                writer.writerow([record.get('file'), record.get('output'), record.get('format'), record.get('error')]
+                                + [record['timings'].get(name, '') for name in stages]
+                                + [record['cpu'].get(name, '') for name in stages]
+                                + [record['counters'].get(name, '') for name in counters])
+
+    def log(self):
+        summary = self.summary()
+        print(f"{'stage':<10}{'count':>7}{'total s':>10}{'cpu s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+
+        for name, stats in summary['stages'].items():
+            print(f"{name:<10}{stats['count']:>7}{stats['total']:>10.2f}{stats['cpu']:>10.2f}"
+                  f"{stats['p50']*1000:>10.1f}{stats['p95']*1000:>10.1f}{stats['p99']*1000:>10.1f}")
+
+        print(', '.join(f"{name}: {value}" for name, value in summary['counters'].items()))
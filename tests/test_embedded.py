@@ -0,0 +1,119 @@
+import random, struct
+from io import BytesIO
+import pytest
+from PIL import Image
+from embedded import front_cover, read_pictures, write_picture, to_synchsafe
+
+AUDIO = random.Random(0).randbytes(4096)
+
+def jpeg(size, noise=False):
+    img = Image.effect_noise(size, 60).convert('RGB') if noise else Image.new('RGB', size, (200, 40, 90))
+    buffer = BytesIO()
+    img.save(buffer, 'jpeg', quality=90)
+    return buffer.getvalue()
+
+# A small cover to start from, a smaller replacement and one too big for any of the files below
+ORIGINAL, SMALLER, LARGER = jpeg((300, 300), noise=True), jpeg((100, 100)), jpeg((600, 600), noise=True)
+
+def flac(path, data, padding=None):
+    mime = b'image/jpeg'
+    picture = (struct.pack('>II', 3, len(mime)) + mime + struct.pack('>I', 5) + b'cover'
+               + struct.pack('>IIIII', 300, 300, 24, 0, len(data)) + data)
+    blocks = bytes([0]) + (34).to_bytes(3, 'big') + bytes(34)
+    blocks += bytes([6 if padding is not None else 0x80 | 6]) + len(picture).to_bytes(3, 'big') + picture
+
+    if padding is not None:
+        blocks += bytes([0x80 | 1]) + padding.to_bytes(3, 'big') + bytes(padding)
+
+    path.write_bytes(b'fLaC' + blocks + AUDIO)
+
+def mp3(path, data, major, padding=0):
+    size = to_synchsafe if major == 4 else lambda value: value.to_bytes(4, 'big')
+    title = b'\0Song'
+    body = b'\0image/jpeg\0\x03cover\0' + data
+    frames = b'TIT2' + size(len(title)) + b'\0\0' + title + b'APIC' + size(len(body)) + b'\0\0' + body + bytes(padding)
+    path.write_bytes(b'ID3' + bytes([major, 0, 0]) + to_synchsafe(len(frames)) + frames + AUDIO)
+
+def rewrite(path, data):
+    before = path.read_bytes()
+    written = write_picture(path, front_cover(path), data)
+    after = path.read_bytes()
+
+    # Tags are rewritten in place, so the file never changes size and the audio never moves
+    assert len(after) == len(before)
+    assert after.endswith(AUDIO)
+
+    return written, before, after
+
+@pytest.mark.parametrize('padding', [None, 0, 2048])
+def test_flac_smaller_picture_round_trips(tmp_path, padding):
+    path = tmp_path / 'track.flac'
+    flac(path, ORIGINAL, padding)
+
+    written, _, _ = rewrite(path, SMALLER)
+
+    assert written
+    pictures = read_pictures(path)
+    assert len(pictures) == 1
+    assert pictures[0]['data'] == SMALLER
+    assert pictures[0]['description'] == b'cover'
+
+@pytest.mark.parametrize('padding', [None, 2048])
+def test_flac_larger_picture_is_left_alone(tmp_path, padding):
+    path = tmp_path / 'track.flac'
+    flac(path, ORIGINAL, padding)
+
+    written, before, after = rewrite(path, LARGER)
+
+    assert not written
+    assert after == before
+
+def test_flac_following_padding_absorbs_growth(tmp_path):
+    path = tmp_path / 'track.flac'
+    flac(path, SMALLER, len(ORIGINAL))
+
+    written, _, _ = rewrite(path, ORIGINAL)
+
+    assert written
+    assert front_cover(path)['data'] == ORIGINAL
+
+def test_flac_without_room_for_a_padding_header_is_left_alone(tmp_path):
+    # Two bytes smaller leaves a gap too small for the padding block that would have to fill it
+    path = tmp_path / 'track.flac'
+    flac(path, ORIGINAL + b'\0\0')
+
+    written, before, after = rewrite(path, ORIGINAL)
+
+    assert not written
+    assert after == before
+
+@pytest.mark.parametrize('major', [3, 4])
+def test_id3_smaller_picture_round_trips(tmp_path, major):
+    path = tmp_path / 'track.mp3'
+    mp3(path, ORIGINAL, major)
+
+    written, _, after = rewrite(path, SMALLER)
+
+    assert written
+    assert front_cover(path)['data'] == SMALLER
+    assert b'TIT2' in after[:len(after) - len(AUDIO)]
+
+@pytest.mark.parametrize('major', [3, 4])
+def test_id3_padding_absorbs_growth(tmp_path, major):
+    path = tmp_path / 'track.mp3'
+    mp3(path, SMALLER, major, padding=len(ORIGINAL))
+
+    written, _, _ = rewrite(path, ORIGINAL)
+
+    assert written
+    assert front_cover(path)['data'] == ORIGINAL
+
+@pytest.mark.parametrize('major', [3, 4])
+def test_id3_picture_that_does_not_fit_is_left_alone(tmp_path, major):
+    path = tmp_path / 'track.mp3'
+    mp3(path, ORIGINAL, major, padding=16)
+
+    written, before, after = rewrite(path, LARGER)
+
+    assert not written
+    assert after == before
@@ -0,0 +1,31 @@
+from io import BytesIO
+import pytest
+from PIL import Image, ImageDraw
+import album_art_normalizer as aan
+
+def keyed_png(mode, key, fill):
+    # Square, so nothing gets padded and the key is the only source of transparency
+    img = Image.new(mode, (400, 400), fill)
+    ImageDraw.Draw(img).rectangle((0, 0, 99, 99), fill=key)
+    buffer = BytesIO()
+    img.save(buffer, 'png', transparency=key)
+    return buffer.getvalue()
+
+@pytest.mark.parametrize('mode, key, fill', [('RGB', (255, 0, 255), (20, 120, 200)), ('L', 0, 128)])
+def test_transparency_key_is_alpha(mode, key, fill):
+    with Image.open(BytesIO(keyed_png(mode, key, fill))) as img:
+        assert aan.analyse(img)['alpha']
+
+@pytest.mark.parametrize('mode, key, fill', [('RGB', (255, 0, 255), (20, 120, 200)), ('L', 0, 128)])
+def test_transparency_key_stays_png(mode, key, fill):
+    [(name, data)] = aan.process(keyed_png(mode, key, fill), 'key', backend='quantize')
+
+    assert name == 'key.png'
+
+    with Image.open(BytesIO(data)) as img:
+        assert img.convert('RGBA').getpixel((0, 0))[3] == 0
+        assert img.convert('RGBA').getpixel((399, 399))[3] == 255
+
+def test_opaque_rgb_has_no_alpha():
+    with Image.new('RGB', (64, 64), (10, 20, 30)) as img:
+        assert aan.analyse(img) == {'alpha': False, 'border': (10, 20, 30)}
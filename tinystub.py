@@ -0,0 +1,79 @@
+import argparse, json, random, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for tinypng.com/web/shrink so uploads can be exercised offline.
+# The "compressed" output is the uploaded bytes unchanged.
+
+class ShrinkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('content-type', content_type)
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get('content-length', 0)))
+        server = self.server
+        time.sleep(server.latency)
+
+        with server.lock:
+            server.uploads += 1
+
+        if self.path != '/web/shrink' or random.random() < server.error_rate:
+            body = {'error': 'TooManyRequests', 'message': 'Stand-in server refused the upload'}
+            return self.reply(429, json.dumps(body).encode(), 'application/json')
+
+        key = uuid.uuid4().hex
+
+        with server.lock:
+            server.outputs[key] = data
+
+        host, port = server.server_address[:2]
+        body = {
+            'input': {'size': len(data), 'type': 'image/png'},
+            'output': {'size': len(data), 'type': 'image/png', 'ratio': 1, 'url': f"http://{host}:{port}/output/{key}"}
+        }
+        self.reply(201, json.dumps(body).encode(), 'application/json')
+
+    def do_GET(self):
+        with self.server.lock:
+            data = self.server.outputs.pop(self.path.rsplit('/', 1)[-1], None)
+
+        if data is None:
+            return self.reply(404, b'', 'text/plain')
+
+        self.reply(200, data, 'image/png')
+
+def serve(host='127.0.0.1', port=0, latency=0, error_rate=0):
+    server = ThreadingHTTPServer((host, port), ShrinkHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    server.uploads = 0
+    server.outputs = {}
+    server.lock = threading.Lock()
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f"http://{server.server_address[0]}:{server.server_address[1]}/web/shrink"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8000, help="Port to listen on. Defaults to 8000.")
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds to wait before answering each upload. Defaults to 0.2.")
+    parser.add_argument('--error-rate', type=float, default=0, help="Fraction of uploads answered with an error. Defaults to 0.")
+    args = parser.parse_args()
+
+    server, url = serve(port=args.port, latency=args.latency, error_rate=args.error_rate)
+    print(f"Serving {url}")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
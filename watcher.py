@@ -0,0 +1,148 @@
+import os, sys, time, select, struct, ctypes, ctypes.util
+from discovery import scan
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct('iIII')
+
+class PollingWatcher:
+    # Portable fallback: rescans every folder and reports files whose size or mtime moved
+    def __init__(self, dirs, ext, exclude=(), interval=2):
+        self.dirs = dirs
+        self.ext = ext
+        self.exclude = exclude
+        self.interval = interval
+        self.snapshot = {}
+        self.last = 0
+
+    def poll(self, timeout):
+        time.sleep(max(0, min(timeout, self.last + self.interval - time.monotonic())))
+
+        if time.monotonic() - self.last < self.interval:
+            return []
+
+        self.last = time.monotonic()
+        snapshot, changed = {}, []
+
+        for root in self.dirs:
+            for entry in scan(root, self.ext, exclude=self.exclude):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+
+                snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                if self.snapshot.get(entry.path) != snapshot[entry.path]: changed.append(entry.path)
+
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    def __init__(self, dirs, ext, exclude=()):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self.ext = ext
+        self.exclude = {os.path.abspath(path) for path in exclude}
+        self.dirs = dirs
+        self.watches = {}
+        self.found = []
+
+        for root in dirs:
+            self.add_tree(root)
+
+    def add_tree(self, root):
+        for path, subdirs, _ in os.walk(root):
+            subdirs[:] = [d for d in subdirs if os.path.abspath(os.path.join(path, d)) not in self.exclude]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY)
+
+            if wd >= 0:
+                self.watches[wd] = path
+
+        # Files can land in a new folder before its watch exists, so pick those up by listing it
+        self.found.extend(entry.path for entry in scan(root, self.ext, exclude=self.exclude))
+
+    def poll(self, timeout):
+        if not self.found and select.select([self.fd], [], [], timeout)[0]:
+            data = os.read(self.fd, 1 << 16)
+            offset = 0
+
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0'))
+                offset += EVENT.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    for root in self.dirs:
+                        self.found.extend(entry.path for entry in scan(root, self.ext, exclude=self.exclude))
+                    continue
+
+                if wd not in self.watches:
+                    continue
+
+                path = os.path.join(self.watches[wd], name)
+
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO) and os.path.abspath(path) not in self.exclude:
+                        self.add_tree(path)
+                elif os.path.splitext(name)[1].lower() in self.ext:
+                    self.found.append(path)
+
+        found, self.found = self.found, []
+        return found
+
+    def close(self):
+        os.close(self.fd)
+
+def make_watcher(dirs, ext, exclude=(), interval=2):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(dirs, ext, exclude)
+        except (OSError, AttributeError, TypeError):
+            pass
+
+    return PollingWatcher(dirs, ext, exclude, interval)
+
+class Debouncer:
+    # A file is ready once its size and mtime have stayed put for `settle` seconds
+    def __init__(self, settle=2):
+        self.settle = settle
+        self.pending = {}
+
+    def add(self, paths):
+        now = time.monotonic()
+
+        for path in paths:
+            self.pending.setdefault(path, (None, now))
+
+    def ready(self):
+        now = time.monotonic()
+        ready = []
+
+        for path, (seen, since) in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+
+            current = (stat.st_size, stat.st_mtime_ns)
+
+            if current != seen:
+                self.pending[path] = (current, now)
+            elif now - since >= self.settle:
+                del self.pending[path]
+                ready.append(path)
+
+        return ready